@@ -0,0 +1,39 @@
+import argparse
+import time
+
+import numpy as np
+
+from jerk import jerk_time, SlewTimeTable
+
+
+def best_time(func, n_repeat=5):
+    """Fastest of n_repeat calls, seconds"""
+    result = np.inf
+    for i in range(n_repeat):
+        t0 = time.time()
+        func()
+        result = min(result, time.time() - t0)
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_distances", type=int, default=2000000)
+    parser.add_argument("--tol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print("limits (v, a, j)    distances  exact (s)  table (s)  speedup  max error")
+    for limits in [(3.5, 3.5, 20), (1.75, 0.875, 5)]:
+        table = SlewTimeTable(*limits, tol=args.tol)
+        for d_max in [0.3, 5., 20., 180.]:
+            distance = rng.uniform(0, d_max, args.n_distances)
+            out = np.empty_like(distance)
+            work = np.empty_like(distance)
+            masks = np.empty((4,) + distance.shape, dtype=bool)
+            t_exact = best_time(lambda: jerk_time(distance, *limits, out=out, work=work, masks=masks))
+            exact = out.copy()
+            t_table = best_time(lambda: table(distance, out=out))
+            print("%-18s  0-%-7g  %9.4f  %9.4f  %7.1f  %9.1e" % (limits, d_max, t_exact, t_table,
+                                                          t_exact / t_table, np.max(np.abs(out - exact))))
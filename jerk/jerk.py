@@ -1,52 +1,335 @@
-__all__ = ("jerk_time",)
+__all__ = ("jerk_time", "slew_time_matrix", "SlewTimeTable")
+
+import hashlib
+import os
 
 import numpy as np
 
 
-def jerk_time(distance, v_max, acc_max, jerk_max):
+def jerk_time(distance, v_max, acc_max, jerk_max, out=None, work=None, masks=None, dtype=None):
     """Calculate how long to move a distance given maximum jerk, acceleration, and velocity
 
     modified from https://github.com/mdhom/py_constant_jerk/blob/main/constantJerk.py
+
+    Parameters
+    ----------
+    distance : float or array
+        Distance(s) to move.
+    v_max : float
+        Maximum velocity.
+    acc_max : float
+        Maximum acceleration.
+    jerk_max : float (None)
+        Maximum jerk. If None, fall back on the infinite jerk approximation.
+    out : np.ndarray (None)
+        Array to write the result into. Must be the same shape as distance.
+    work : np.ndarray (None)
+        Scratch array, same shape and dtype as out. Only used if
+        some distances land in the cube root or case 6 branches.
+    masks : np.ndarray (None)
+        Scratch bool array of shape (4,) + distance.shape for the case masks.
+    dtype : np.dtype (None)
+        Dtype of the result if out is not given. Default float64.
+        float32 is faster, but no longer bit-for-bit with float64.
+
+    With out, work and masks given, and distance already in the dtype of
+    out, no full size temporary arrays are made. Otherwise each missing
+    one is allocated, and distance is copied to the dtype of out (e.g.,
+    float64 distances with a float32 out).
     """
 
     # If distance is a scalar, convert to array.
     distance = np.atleast_1d(distance)
 
+    if out is None:
+        out = np.empty(distance.shape, dtype=np.float64 if dtype is None else dtype)
+
     # If there is no jerk, fall back on infinite jerk approximation
     if jerk_max is None:
-        return acc_time(distance, v_max, acc_max)
+        out[...] = acc_time(distance, v_max, acc_max)
+        return out
 
-    trajectory_instance_case = get_trajectory_instance_case(
-        distance, v_max, acc_max, jerk_max
-    )
+    return _jerk_time_single_pass(distance, v_max, acc_max, jerk_max, out, work, masks)
 
-    unique_trag = np.unique(trajectory_instance_case)
 
-    if np.size(unique_trag) == 1:
-        tj, ta, tv = calculate_times(
-            distance,
-            v_max,
-            acc_max,
-            jerk_max,
-            trajectory_instance_case=unique_trag,
-        )
-        result = tv + tj + ta
+def _jerk_time_single_pass(distance, v_max, acc_max, jerk_max, out, work=None, masks=None):
+    """Classify and evaluate all the trajectory cases in one pass.
+
+    The case thresholds only depend on the (scalar) kinematic limits,
+    so the v_max vs v_a comparisons from get_trajectory_instance_case
+    pick a branch once, and the distances only need comparing to s_a and s_v.
+    Cases 1, 3 and 5 share the same form (distance / v_max + tj + ta),
+    as do cases 2 and 4. Operations are done in the same order as
+    calculate_times so results are identical to the case-by-case path.
+    The masks are written into the four slices of masks, so with work
+    and masks passed in nothing the size of distance is allocated.
+    """
+    ftype = out.dtype.type
+    distance = np.asarray(distance, dtype=out.dtype)
+
+    v_a = acc_max * acc_max / jerk_max
+    s_a = 2 * acc_max * acc_max * acc_max / (jerk_max * jerk_max)
+    if v_max * jerk_max < acc_max * acc_max:
+        s_v = v_max * 2 * np.sqrt(v_max / jerk_max)
     else:
-        result = np.zeros(np.size(distance))
-        for tic in unique_trag:
-            indx = np.where(trajectory_instance_case == tic)[0]
-            tj, ta, tv = calculate_times(
-                distance[indx],
-                v_max,
-                acc_max,
-                jerk_max,
-                trajectory_instance_case=tic,
-            )
-            result[indx] = tv + tj + ta
+        s_v = v_max * (v_max / acc_max + acc_max / jerk_max)
+
+    if masks is None:
+        masks = np.empty((4,) + distance.shape, dtype=bool)
+    below_s_a = np.less(distance, s_a, out=masks[0])
+    above_s_a = np.greater(distance, s_a, out=masks[1])
+    if v_max > v_a:
+        # Cases 2, 5, 6
+        linear = np.greater_equal(distance, s_v, out=masks[2])
+        linear &= above_s_a
+        case_6 = np.less(distance, s_v, out=masks[3])
+        case_6 &= above_s_a
+        cube = below_s_a
+        tj = ftype(acc_max / jerk_max)
+        ta = ftype(v_max / acc_max)
+    elif v_max < v_a:
+        # Cases 1, 3, 4
+        case_6 = None
+        linear = np.greater(distance, s_v, out=masks[2])
+        linear &= below_s_a
+        linear |= above_s_a
+        cube = np.less(distance, s_v, out=masks[3])
+        cube &= below_s_a
+        tj = ftype(np.sqrt(v_max / jerk_max))
+        ta = tj
+    else:
+        # Only case 1 possible
+        case_6 = None
+        linear = above_s_a
+        cube = None
+        tj = ftype(np.sqrt(v_max / jerk_max))
+        ta = tj
+
+    n_good = np.count_nonzero(linear)
+    if cube is not None:
+        n_good += np.count_nonzero(cube)
+    if case_6 is not None:
+        n_good += np.count_nonzero(case_6)
+    if n_good != distance.size:
+        raise Exception("TrajectoryInstance must be between 1 and 6")
+
+    # tv + tj + ta with tv = distance / v_max
+    np.divide(distance, ftype(v_max), out=out, where=linear)
+    np.add(out, tj, out=out, where=linear)
+    np.add(out, ta, out=out, where=linear)
+
+    if (cube is not None and cube.any()) or (case_6 is not None and case_6.any()):
+        if work is None:
+            work = np.empty_like(out)
+
+    if cube is not None and cube.any():
+        # tj = ta = cube root, tv = 2 * tj
+        np.divide(distance, ftype(2 * jerk_max), out=work, where=cube)
+        np.power(work, ftype(1.0 / 3.0), out=work, where=cube)
+        np.multiply(work, ftype(2), out=out, where=cube)
+        np.add(out, work, out=out, where=cube)
+        np.add(out, work, out=out, where=cube)
+
+    if case_6 is not None and case_6.any():
+        # ta into work, tv = ta + tj
+        np.multiply(distance, ftype(4), out=work, where=case_6)
+        np.multiply(work, ftype(jerk_max), out=work, where=case_6)
+        np.multiply(work, ftype(jerk_max), out=work, where=case_6)
+        np.add(work, ftype(acc_max * acc_max * acc_max), out=work, where=case_6)
+        np.divide(work, ftype(acc_max * jerk_max * jerk_max), out=work, where=case_6)
+        np.sqrt(work, out=work, where=case_6)
+        np.subtract(work, tj, out=work, where=case_6)
+        np.multiply(work, ftype(0.5), out=work, where=case_6)
+        np.add(work, tj, out=out, where=case_6)
+        np.add(out, tj, out=out, where=case_6)
+        np.add(out, work, out=out, where=case_6)
+
+    return out
+
+
+def slew_time_matrix(current, targets, limits, max_elements=2**22):
+    """Time to slew from each of N positions to each of M targets on several axes
+
+    The axes move simultaneously, so the slew time is the max over axes.
+
+    Parameters
+    ----------
+    current : array (N, n_axes)
+        Starting positions, e.g., columns of alt, az, rotator angle.
+    targets : array (M, n_axes)
+        Target positions, same axes and units as current.
+    limits : list of tuples
+        One (v_max, acc_max, jerk_max) tuple per axis. jerk_max can be None.
+    max_elements : int (2**22)
+        Maximum number of elements in the working (rows, M) block, sets
+        how much memory is used.
+
+    Returns
+    -------
+    result : array (N, M)
+        Slew times.
+    """
+    current = np.atleast_2d(current).astype(float)
+    targets = np.atleast_2d(targets).astype(float)
+    if (current.shape[1] != len(limits)) | (targets.shape[1] != len(limits)):
+        raise ValueError("Need one set of limits for each axis")
+
+    n_current = current.shape[0]
+    n_targets = targets.shape[0]
+    result = np.empty((n_current, n_targets))
+
+    rows = max(1, min(n_current, max_elements // max(n_targets, 1)))
+    # Scratch arrays shared by all the axes and blocks
+    distance = np.empty((rows, n_targets))
+    axis_time = np.empty((rows, n_targets))
+    work = np.empty((rows, n_targets))
+    masks = np.empty((4, rows, n_targets), dtype=bool)
+
+    for start in range(0, n_current, rows):
+        end = min(start + rows, n_current)
+        n_rows = end - start
+        block = result[start:end]
+        for i, (v_max, acc_max, jerk_max) in enumerate(limits):
+            dist = distance[:n_rows]
+            np.subtract(current[start:end, i][:, np.newaxis], targets[:, i], out=dist)
+            np.abs(dist, out=dist)
+            if i == 0:
+                jerk_time(dist, v_max, acc_max, jerk_max, out=block, work=work[:n_rows],
+                          masks=masks[:, :n_rows])
+            else:
+                jerk_time(dist, v_max, acc_max, jerk_max, out=axis_time[:n_rows], work=work[:n_rows],
+                          masks=masks[:, :n_rows])
+                np.maximum(block, axis_time[:n_rows], out=block)
 
     return result
 
 
+class SlewTimeTable(object):
+    """Precomputed jerk_time on a distance grid, queried by linear interpolation
+
+    Each case of jerk_time is concave in distance, so for a grid cell
+    [a, b] the linear interpolation error is at most
+    (b-a) * (f'(a) - f'(b)) / 4, and the chord slopes of the neighboring
+    cells bound f'(a) and f'(b). Cells where that bound is above the
+    tolerance (or can't be computed, like the first and last cell, or
+    across a non-concave case transition) are flagged by a NaN
+    interpolation step and evaluated exactly. Distances outside
+    [0, d_max] also use jerk_time.
+
+    A lookup costs about the same as the linear branch of jerk_time, so
+    the table pays off once some of the distances are short enough for
+    the cube and square root branches (about 5x faster for slews up to
+    20 degrees, see bench_jerk.py). When nearly all the slews are long,
+    exact jerk_time is as fast.
+
+    Parameters
+    ----------
+    v_max : float
+        Maximum velocity.
+    acc_max : float
+        Maximum acceleration.
+    jerk_max : float
+        Maximum jerk. Can be None.
+    d_max : float (180.)
+        Maximum distance covered by the table.
+    tol : float (1e-4)
+        Maximum interpolation error, in the units of jerk_time.
+    max_points : int (2**24)
+        Stop refining the grid after this many points.
+    cache_dir : str (None)
+        Directory to save/load the table as .npy files. The files are
+        loaded memory-mapped. If None, the table is not saved.
+    """
+
+    def __init__(self, v_max, acc_max, jerk_max, d_max=180., tol=1e-4,
+                 max_points=2**24, cache_dir=None):
+        self.v_max = v_max
+        self.acc_max = acc_max
+        self.jerk_max = jerk_max
+        self.d_max = float(d_max)
+        self.tol = tol
+
+        if cache_dir is not None:
+            key = repr((v_max, acc_max, jerk_max, self.d_max, tol, max_points))
+            root = os.path.join(cache_dir, "slew_table_" + hashlib.md5(key.encode()).hexdigest())
+            times_file = root + "_times.npy"
+            delta_file = root + "_delta.npy"
+            if not (os.path.isfile(times_file) & os.path.isfile(delta_file)):
+                self._build(max_points)
+                os.makedirs(cache_dir, exist_ok=True)
+                # Write to temp names then rename, so other processes never see partial files
+                for filename, values in zip([times_file, delta_file], [self.times, self.delta]):
+                    temp_file = filename + ".%i.tmp.npy" % os.getpid()
+                    np.save(temp_file, values)
+                    os.replace(temp_file, filename)
+            self.times = np.load(times_file, mmap_mode="r")
+            self.delta = np.load(delta_file, mmap_mode="r")
+        else:
+            self._build(max_points)
+
+        self.step = self.d_max / (self.times.size - 1)
+
+    def _build(self, max_points):
+        """Double the number of grid points until (almost) no cells need exact evaluation"""
+        n_points = 1025
+        while True:
+            grid = np.linspace(0, self.d_max, n_points)
+            times = jerk_time(grid, self.v_max, self.acc_max, self.jerk_max)
+            step = grid[1] - grid[0]
+            slopes = np.diff(times) / step
+
+            # Error bound for cells 1 to n-3, using the neighboring chord slopes
+            exact = np.ones(n_points - 1, dtype=bool)
+            left = slopes[:-2]
+            right = slopes[2:]
+            # Allow for round-off in the slopes where the time is linear in distance
+            slack = 4 * np.finfo(float).eps * np.max(np.abs(times)) / step
+            concave = (left >= slopes[1:-1] - slack) & (slopes[1:-1] >= right - slack)
+            bound = step * (left - right + 2 * slack) / 4.
+            exact[1:-1] = ~concave | (bound > self.tol)
+
+            if (np.mean(exact) < 0.001) | (n_points * 2 - 1 > max_points):
+                break
+            n_points = n_points * 2 - 1
+
+        self.times = times
+        self.delta = np.diff(times)
+        self.delta[exact] = np.nan
+
+    def __call__(self, distance, out=None):
+        """Slew time for distance(s)
+
+        Parameters
+        ----------
+        distance : float or array
+            Distance(s) to move. float64 arrays are used without a copy.
+        out : np.ndarray (None)
+            float64 array to write the result into, same shape as distance.
+        """
+        distance = np.atleast_1d(np.asarray(distance, dtype=float))
+        if out is None:
+            out = np.empty(distance.shape)
+
+        # frac holds the position in the cell, then the table times
+        frac = np.multiply(distance, 1. / self.step)
+        indx = frac.astype(np.intp)
+        np.clip(indx, 0, self.delta.size - 1, out=indx)
+        frac -= indx
+        np.take(self.delta, indx, out=out)
+        out *= frac
+        np.take(self.times, indx, out=frac)
+        out += frac
+
+        need_exact = np.isnan(out)
+        if (distance.size > 0) and ((distance.min() < 0) or (distance.max() > self.d_max)):
+            need_exact |= (distance < 0) | (distance > self.d_max)
+        indx = np.flatnonzero(need_exact)
+        if indx.size > 0:
+            out[indx] = jerk_time(distance[indx], self.v_max, self.acc_max, self.jerk_max)
+
+        return out
+
+
 def acc_time(distance, v_max, acc_max):
     """Time to move given a maximum velocity and acceleration. Assumes infinite jerk."""
 
@@ -1,22 +1,191 @@
+import argparse
+import json
+import os
+import sys
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import numpy as np
 
+KEYS = ["streak_lengths", "n_streaks"]
 
-if __name__ == "__main__":
 
+def npz_header(filename, keys=KEYS):
+    """Shape and dtype of each array in an npz file, from the .npy headers
+
+    Only the headers are read, not the data.
+
+    Returns
+    -------
+    header : dict
+        key : (shape, dtype)
+    """
+    result = {}
+    with zipfile.ZipFile(filename) as npz:
+        for key in keys:
+            with npz.open(key + ".npy") as infile:
+                version = np.lib.format.read_magic(infile)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+            result[key] = (shape, dtype)
+    return result
+
+
+def read_manifest(filename):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as infile:
+        return json.load(infile)
+
+
+def write_manifest(manifest, filename):
+    temp_file = filename + ".%i.tmp" % os.getpid()
+    with open(temp_file, "w") as outfile:
+        json.dump(manifest, outfile)
+    os.replace(temp_file, filename)
+
+
+def _merge_block(filename, outputs, offsets, sizes):
+    """Copy one block into its slices of the outputs"""
+    with np.load(filename) as data:
+        for key in outputs:
+            block = data[key]
+            if block.shape[0] != sizes[key]:
+                raise ValueError("%s has %i %s, header says %i" % (filename, block.shape[0], key, sizes[key]))
+            outputs[key][offsets[key]:offsets[key] + sizes[key]] = block
+
+
+def gather(n_blocks=200, pattern="streaks_all_%i.npz", out_root="streaks_all", keys=KEYS, n_threads=8):
+    """Merge the blocks from standard_stat.py into memory-mapped .npy files
+
+    All the block headers are read first to size the outputs, which are then
+    made with open_memmap and filled a block at a time by a thread pool, so only
+    a few blocks are ever in memory. Blocks that are missing or can not be read
+    are reported and left out; a block that fails while its data is read keeps
+    its (zeroed) slice and is tried again on the next run. A manifest of the
+    merged blocks (with their file size and mtime) is kept next to the outputs,
+    so re-running only merges the blocks that are not already in place.
 
-    lengths = []
-    ns = []
+    Parameters
+    ----------
+    n_blocks : int (200)
+        Number of blocks.
+    pattern : str ("streaks_all_%i.npz")
+        Block filenames.
+    out_root : str ("streaks_all")
+        Outputs are out_root + "_<key>.npy", manifest is out_root + "_manifest.json".
+    n_threads : int (8)
+        Number of blocks to read at once.
+
+    Returns
+    -------
+    outputs : dict
+        key : memory-mapped array.
+    missing, corrupt : list of int
+        Block indices left out.
+    """
+    out_files = {key: "%s_%s.npy" % (out_root, key) for key in keys}
+    manifest_file = "%s_manifest.json" % out_root
+
+    # Size everything from the headers
+    blocks = []
+    missing = []
+    corrupt = []
+    shapes = {}
+    dtypes = {}
+    for i in range(n_blocks):
+        filename = pattern % i
+        if not os.path.isfile(filename):
+            missing.append(i)
+            continue
+        try:
+            header = npz_header(filename, keys=keys)
+        except (zipfile.BadZipFile, KeyError, ValueError, OSError) as error:
+            print("block %i (%s) is corrupt: %s" % (i, filename, error))
+            corrupt.append(i)
+            continue
+        if any(shapes.get(key, header[key][0])[1:] != header[key][0][1:] for key in keys):
+            print("block %i (%s) has the wrong shape: %s" % (i, filename, header))
+            corrupt.append(i)
+            continue
+        for key in keys:
+            shapes.setdefault(key, header[key][0])
+            dtypes.setdefault(key, header[key][1])
+        stat = os.stat(filename)
+        blocks.append({"i": i, "filename": filename, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                       "lengths": {key: header[key][0][0] for key in keys}})
+    if len(missing) > 0:
+        print("missing blocks: %s" % missing)
+
+    offsets = {key: 0 for key in keys}
+    for block in blocks:
+        block["offsets"] = dict(offsets)
+        for key in keys:
+            offsets[key] += block["lengths"][key]
+    out_shapes = {key: (offsets[key],) + tuple(shapes.get(key, (0,))[1:]) for key in keys}
+    layout = {"shapes": {key: list(out_shapes[key]) for key in keys},
+              "dtypes": {key: np.dtype(dtypes.get(key, float)).str for key in keys}}
+
+    # Blocks already merged into outputs with the same layout can be skipped
+    manifest = read_manifest(manifest_file)
+    if ((manifest is None) or (manifest["layout"] != layout) or
+            (not all(os.path.isfile(out_files[key]) for key in keys))):
+        manifest = {"layout": layout, "merged": {}}
+        outputs = {key: np.lib.format.open_memmap(out_files[key], mode="w+", dtype=layout["dtypes"][key],
+                                                  shape=out_shapes[key]) for key in keys}
+        write_manifest(manifest, manifest_file)
+    else:
+        outputs = {key: np.load(out_files[key], mmap_mode="r+") for key in keys}
+
+    def already_merged(block):
+        done = manifest["merged"].get(str(block["i"]))
+        return (done is not None) and (done == {k: block[k] for k in ["size", "mtime", "offsets"]})
+
+    to_merge = [block for block in blocks if not already_merged(block)]
+    print("%i blocks to merge, %i already merged" % (len(to_merge), len(blocks) - len(to_merge)))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = {executor.submit(_merge_block, block["filename"], outputs, block["offsets"],
+                                   block["lengths"]): block for block in to_merge}
+        for future in as_completed(futures):
+            block = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                print("block %i (%s) is corrupt: %s" % (block["i"], block["filename"], error))
+                corrupt.append(block["i"])
+                continue
+            manifest["merged"][str(block["i"])] = {k: block[k] for k in ["size", "mtime", "offsets"]}
+
+    for key in keys:
+        outputs[key].flush()
+    write_manifest(manifest, manifest_file)
+    if len(corrupt) > 0:
+        print("corrupt blocks: %s" % sorted(corrupt))
+
+    return outputs, missing, sorted(corrupt)
+
+
+if __name__ == "__main__":
 
-    for i in np.arange(200):
-        filename = "streaks_all_%i.npz" % i
-        data = np.load(filename)
-        lengths.append(data["streak_lengths"].copy())
-        ns.append(data["n_streaks"].copy())
-        data.close()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_blocks", type=int, default=200)
+    parser.add_argument("--n_threads", type=int, default=8)
+    parser.add_argument("--no_npz", dest="npz", action="store_false",
+                        help="Skip writing streaks_all.npz, only make the .npy files")
+    parser.add_argument("--allow_partial", dest="allow_partial", action="store_true",
+                        help="Write streaks_all.npz even if blocks are missing or corrupt")
+    args = parser.parse_args()
 
+    outputs, missing, corrupt = gather(n_blocks=args.n_blocks, n_threads=args.n_threads)
 
-    streak_lengths = np.concatenate(lengths)
-    n_streaks = np.concatenate(ns)
+    # Missing blocks would make a short npz, and corrupt ones leave zeros that look like visits
+    if ((len(missing) > 0) | (len(corrupt) > 0)) & (not args.allow_partial):
+        print("Not writing streaks_all.npz, %i missing and %i corrupt blocks (use --allow_partial)" %
+              (len(missing), len(corrupt)))
+        sys.exit(1)
 
-    np.savez("streaks_all.npz", streak_lengths=streak_lengths, n_streaks=n_streaks)
-    
\ No newline at end of file
+    if args.npz:
+        np.savez("streaks_all.npz", streak_lengths=outputs["streak_lengths"], n_streaks=outputs["n_streaks"])
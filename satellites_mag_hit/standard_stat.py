@@ -10,37 +10,73 @@ import pandas as pd
 import sqlite3
 import os
 import argparse
+import sys
+import time
+
+# Visit columns the tasks need, all stored as float
+KEYS = ['fieldRA', 'fieldDec', 'fiveSigmaDepth',
+        'observationStartMJD', 'rotSkyPos', 'visitExposureTime', 'numExposures']
+
+
+def extract_visits(outfile='visits_year1.npy', night_max=365):
+    """Write the year 1 baseline visits to a structured .npy, once for all the tasks
+
+    Written to a temp file and renamed, so tasks never see a partial file.
+    """
+    baseline = get_baseline()
+    con = sqlite3.connect(baseline)
+    visits = pd.read_sql('select %s from observations where night < %i' % (', '.join(KEYS), night_max), con)
+    con.close()
+
+    temp_file = outfile + '.%i.tmp.npy' % os.getpid()
+    numpy_visits = np.lib.format.open_memmap(temp_file, mode='w+', dtype=list(zip(KEYS, [float] * len(KEYS))),
+                                             shape=(visits.shape[0],))
+    for key in KEYS:
+        numpy_visits[key] = visits[key].values
+    numpy_visits.flush()
+    del numpy_visits
+    os.replace(temp_file, outfile)
+
+
+def load_block(filename, i, n_blocks):
+    """Block i of n_blocks of the visits, the same rows as np.array_split
+
+    The file is memory-mapped, so only the rows of the block are read from disk.
+    """
+    visits = np.load(filename, mmap_mode='r')
+    n_per, n_extra = divmod(visits.size, n_blocks)
+    start = i * n_per + min(i, n_extra)
+    end = start + n_per + (i < n_extra)
+    return visits[start:end]
+
 
 if __name__ == "__main__":
+    t0 = time.time()
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--i", type=int, default=0)
     parser.add_argument("--n_blocks", type=int, default=200)
+    parser.add_argument("--visits_file", type=str, default='visits_year1.npy')
+    parser.add_argument("--extract", dest="extract", action="store_true",
+                        help="Only write visits_file, run once before the tasks")
     args = parser.parse_args()
 
+    if args.extract | (not os.path.isfile(args.visits_file)):
+        extract_visits(outfile=args.visits_file)
+        print('extracted visits to %s in %.1f s' % (args.visits_file, time.time() - t0))
+        if args.extract:
+            sys.exit(0)
+
     save_file = 'streaks_all_%i.npz' % args.i
 
+    numpy_visits = load_block(args.visits_file, args.i, args.n_blocks)
+    print('loaded %i visits in %.2f s' % (numpy_visits.size, time.time() - t0))
+
     # a starlink gen 2 + oneweb
     tles = starlink_tles_v2() # + oneweb_tles()
     const = Constellation(tles)
     print('number of satellites= ', len(tles))
-
-    baseline = get_baseline()
-    con = sqlite3.connect(baseline)
-    # year 1
-    visits = pd.read_sql('select fieldRA, fieldDec, fivesigmadepth, observationstartmjd,rotSkyPos,visitExposureTime,numExposures from observations where night < 365', con)
-    con.close()
-
-    keys = ['fieldRA', 'fieldDec', 'fiveSigmaDepth',
-            'observationStartMJD', 'rotSkyPos', 'visitExposureTime', 'numExposures']
-    types = [float] * len(keys)
-
-    numpy_visits = np.zeros(np.size(visits["fieldRA"].values), dtype=list(zip(keys, types)))
-
-    for key in keys:
-        numpy_visits[key] = visits[key].values
-
-    numpy_visits = np.array_split(numpy_visits, args.n_blocks)[args.i]
+    print('startup time %.2f s' % (time.time() - t0))
 
     streak_lengths, n_streaks = const.check_pointings(numpy_visits["fieldRA"],
                                                       numpy_visits["fieldDec"],
@@ -0,0 +1,55 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from rubin_sim.scheduler.utils import empty_observation, SchemaConverter
+
+from opsim_writer import write_opsim
+
+
+def fake_observations(n_rows, seed=42):
+    """Observations with random values in every column"""
+    rng = np.random.default_rng(seed)
+    observations = np.zeros(n_rows, dtype=empty_observation().dtype)
+    for name in observations.dtype.names:
+        kind = observations.dtype[name].kind
+        if kind == "f":
+            observations[name] = rng.random(n_rows)
+        elif kind == "i":
+            observations[name] = rng.integers(0, 1000, n_rows)
+        else:
+            observations[name] = rng.choice(list("ugrizy"), n_rows)
+    observations["mjd"] = np.sort(60000 + rng.random(n_rows) * 3650)
+    return observations
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_rows", type=int, default=1000000)
+    parser.add_argument("--outdir", type=str, default=".",
+                        help="Where to write the test databases, the filesystem matters")
+    args = parser.parse_args()
+
+    observations = fake_observations(args.n_rows)
+    file_old = os.path.join(args.outdir, "bench_obs2opsim.db")
+    file_new = os.path.join(args.outdir, "bench_write_opsim.db")
+
+    t0 = time.time()
+    SchemaConverter().obs2opsim(observations, filename=file_old, delete_past=True)
+    rate_old = args.n_rows / (time.time() - t0)
+
+    t0 = time.time()
+    write_opsim(observations, file_new)
+    rate_new = args.n_rows / (time.time() - t0)
+
+    t0 = time.time()
+    write_opsim(observations, file_new, indexes=["observationStartMJD", "night"])
+    rate_indx = args.n_rows / (time.time() - t0)
+
+    print("obs2opsim %.0f rows/s, write_opsim %.0f rows/s (%.1fx), with 2 indexes %.0f rows/s" %
+          (rate_old, rate_new, rate_new / rate_old, rate_indx))
+
+    for filename in [file_old, file_new]:
+        os.remove(filename)
@@ -5,6 +5,9 @@ import os
 import pandas as pd
 import numpy as np
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from summary_store import write_store, NULL_NAME
 
 
 def construct_runname(inpath, replaces=['_glance', '_sci', '_meta', '_ss', '_ddf']):
@@ -16,10 +19,21 @@ def construct_runname(inpath, replaces=['_glance', '_sci', '_meta', '_ss', '_ddf
     return result
 
 
-def fast_gather(dirname='.', dbfilename='resultsDb_sqlite.db'):
-    """Let's gather up a bunch of resultDb's 
-    """
+# querry to grab all the summary stats
+SUMMARY_QUERY = ('select metrics.metricname, metrics.metricInfoLabel, summarystats.summaryName, '
+                 'summarystats.summaryValue '
+                 'FROM summarystats INNER JOIN metrics ON metrics.metric_id=summarystats.metric_id')
+
+RECORD_COLUMNS = ['run', 'metric', 'info_label', 'summary', 'value']
+
+
+def find_dbs(dirname='.', dbfilename='resultsDb_sqlite.db'):
+    """Find the resultsDb files in the subdirectories of dirname
 
+    Returns
+    -------
+    db_files, run_names : list of str
+    """
     potential_dirs = glob.glob(dirname + '/*/')
 
     db_files = []
@@ -29,44 +43,163 @@ def fast_gather(dirname='.', dbfilename='resultsDb_sqlite.db'):
         if os.path.isfile(fname):
             db_files.append(fname)
             run_names.append(construct_runname(dname))
+    return db_files, run_names
+
+
+def read_summaries(fname, run_name):
+    """Summary stats of one resultsDb as long format records"""
+    con = sqlite3.connect(fname)
+    temp_df = pd.read_sql(SUMMARY_QUERY, con)
+    con.close()
+    temp_df.columns = RECORD_COLUMNS[1:]
+    temp_df.insert(0, 'run', run_name)
+    return temp_df
 
-    # querry to grab all the summary stats
-    sql_q = 'select metrics.metricname, metrics.metricInfoLabel, summarystats.summaryName, summarystats.summaryValue '
-    sql_q += 'FROM summarystats INNER JOIN metrics ON metrics.metric_id=summarystats.metric_id'
 
-    rows = []
+def gather_records(db_files, run_names, n_threads=8):
+    """Read the summary stats of many resultsDb files at once
+
+    Returns
+    -------
+    records : pd.DataFrame
+        One row per summary stat, with run, metric, info_label, summary and value
+        columns, in the order of db_files.
+    """
+    return concat_records(read_all_summaries(db_files, run_names, n_threads=n_threads))
 
-    for row_name, fname in zip(run_names, db_files):
-        con = sqlite3.connect(fname)
-        temp_df = pd.read_sql(sql_q, con)
-        con.close()
-        
-        spaces = np.char.array([' ']*np.size(temp_df['metricName'].values))
-        s1 = np.char.array(temp_df['metricName'].values.tolist())
-        s2 = np.char.array(temp_df['metricInfoLabel'].values.tolist())
-        s3 = np.char.array(temp_df['summaryName'].values.tolist())
-        col_names = s1 + spaces + s2 + spaces + s3
 
-        # Make a DataFrame row
-        row = pd.DataFrame(temp_df['summaryValue'].values.reshape([1, temp_df['summaryValue'].values.size]),
-                           columns=col_names, index=[row_name])
-        rows.append(row)
+def read_all_summaries(db_files, run_names, n_threads=8):
+    """read_summaries for each db, in a thread pool, returns a list of DataFrames"""
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(read_summaries, db_files, run_names))
 
-    # Create final large DataFrame to hold everything
-    all_cols = np.unique(np.concatenate([r.columns.values for r in rows]))
-    u_names = np.unique(run_names)
-    result_df = pd.DataFrame(np.zeros([u_names.size, all_cols.size])+np.nan, columns=all_cols, index=u_names)
 
-    # Put each row into the final DataFrame
-    for row_name, row in zip(run_names, rows):
-        result_df.loc[row_name][row.columns] = np.ravel(row.values)
+def concat_records(dfs):
+    """Stack long format record DataFrames"""
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=RECORD_COLUMNS)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def pivot_records(records):
+    """Turn long format records into one row per run, one column per summary stat
+
+    Columns are named "metricName metricInfoLabel summaryName", with "nan" for a
+    NULL name (e.g., "Mean nan Median"), as the original fast_gather did. Runs and columns
+    are sorted. If a run has a stat more than once (several directories can map
+    to the same run name), the last one read is kept.
+    """
+    col_names = (records['metric'].fillna(NULL_NAME) + ' ' + records['info_label'].fillna(NULL_NAME) + ' ' +
+                 records['summary'].fillna(NULL_NAME))
+    wide = pd.DataFrame({'run': records['run'], 'col': col_names,
+                         'value': records['value'].astype(float)})
+    wide = wide.drop_duplicates(subset=['run', 'col'], keep='last')
+    wide = wide.pivot(index='run', columns='col', values='value')
+    wide = wide.reindex(index=np.unique(wide.index.values), columns=np.unique(wide.columns.values))
+    wide.index.name = None
+    wide.columns.name = None
+    return wide
+
+
+class GatherCache(object):
+    """Summary records of each resultsDb, saved between gathers
+
+    Each database is stored with its size and mtime. Only databases that are new
+    or have changed since they were cached get read again, and databases that
+    no longer exist are dropped from the cache.
+
+    Parameters
+    ----------
+    filename : str ('gather_cache.pkl')
+        Where to keep the cache.
+    """
+
+    def __init__(self, filename='gather_cache.pkl'):
+        self.filename = filename
+        # absolute path of db : (size, mtime_ns, records DataFrame)
+        self.entries = {}
+        if os.path.isfile(filename):
+            self.entries = pd.read_pickle(filename)
+        self.n_read = 0
+        self.n_cached = 0
+        self.n_evicted = 0
+
+    def records(self, db_files, run_names, n_threads=8):
+        """Long format records for db_files, reading only what is not cached
+
+        Returns
+        -------
+        records : pd.DataFrame
+            Same as gather_records(db_files, run_names).
+        """
+        keys = [os.path.abspath(fname) for fname in db_files]
+        # stat before reading, so a db changed during the read is read again next time
+        stats = [os.stat(key) for key in keys]
+        stale = []
+        for i, (key, stat) in enumerate(zip(keys, stats)):
+            entry = self.entries.get(key)
+            if (entry is None) or (entry[0] != stat.st_size) or (entry[1] != stat.st_mtime_ns):
+                stale.append(i)
+
+        new_dfs = read_all_summaries([db_files[i] for i in stale], [run_names[i] for i in stale],
+                                     n_threads=n_threads)
+        for i, df in zip(stale, new_dfs):
+            self.entries[keys[i]] = (stats[i].st_size, stats[i].st_mtime_ns, df)
+        self.n_read = len(stale)
+        self.n_cached = len(keys) - len(stale)
+
+        gone = [key for key in self.entries if not os.path.isfile(key)]
+        for key in gone:
+            del self.entries[key]
+        self.n_evicted = len(gone)
+
+        return concat_records([self.entries[key][2] for key in keys])
+
+    def save(self):
+        """Write the cache to a temp file and rename it, so a kill never leaves half a file"""
+        temp_file = self.filename + '.%i.tmp' % os.getpid()
+        pd.to_pickle(self.entries, temp_file)
+        os.replace(temp_file, self.filename)
+
+
+def fast_gather(dirname='.', dbfilename='resultsDb_sqlite.db', n_threads=8, cache_file=None):
+    """Let's gather up a bunch of resultDb's 
+
+    Returns one row per run and one column per summary stat, see pivot_records.
+
+    Parameters
+    ----------
+    dirname : str ('.')
+        Directory with one subdirectory per run.
+    dbfilename : str ('resultsDb_sqlite.db')
+        Name of the results database in each run directory.
+    n_threads : int (8)
+        Number of databases to read at once.
+    cache_file : str (None)
+        If set, keep the records of each database in a GatherCache there, and
+        only read the databases that are new or changed.
+    """
+    records = fast_gather_records(dirname=dirname, dbfilename=dbfilename, n_threads=n_threads,
+                                  cache_file=cache_file)
+    return pivot_records(records)
+
 
-    return result_df
+def fast_gather_records(dirname='.', dbfilename='resultsDb_sqlite.db', n_threads=8, cache_file=None):
+    """fast_gather, but return the long format records before the pivot"""
+    db_files, run_names = find_dbs(dirname=dirname, dbfilename=dbfilename)
+    if cache_file is None:
+        return gather_records(db_files, run_names, n_threads=n_threads)
+    cache = GatherCache(cache_file)
+    records = cache.records(db_files, run_names, n_threads=n_threads)
+    cache.save()
+    return records
 
 
 if __name__ == '__main__':
 
-    result = fast_gather()
+    records = fast_gather_records(cache_file='gather_cache.pkl')
+    result = pivot_records(records)
     result.to_hdf('summary.h5', key="stats")
+    write_store(records, 'summary_store')
 
 
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from rubin_sim.scheduler.utils import SchemaConverter
+
+
+# sqlite column types, the same ones pandas to_sql uses
+SQL_TYPES = {"f": "REAL", "i": "INTEGER", "u": "INTEGER", "b": "INTEGER", "U": "TEXT", "S": "TEXT",
+             "O": "TEXT"}
+
+
+class OpsimWriter(object):
+    """Bulk load observations into an opsim schema sqlite file
+
+    Writes the same observations table as SchemaConverter.obs2opsim, but rows go in
+    with executemany in batches, each append is one transaction, and the file is
+    in WAL mode with synchronous=OFF while loading. Indexes are only made in close,
+    after all the rows are in.
+
+    Parameters
+    ----------
+    filename : str
+        Output sqlite file.
+    converter : SchemaConverter (None)
+        Sets the column names and angle conversions. Default is a new SchemaConverter.
+    batch_size : int (100000)
+        Number of rows for each executemany call.
+    delete_past : bool (True)
+        Delete filename if it already exists. If False, rows are added to its
+        observations table.
+    """
+
+    def __init__(self, filename, converter=None, batch_size=100000, delete_past=True):
+        if delete_past & os.path.isfile(filename):
+            os.remove(filename)
+        self.filename = filename
+        self.converter = SchemaConverter() if converter is None else converter
+        self.batch_size = batch_size
+        self.n_rows = 0
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("pragma journal_mode=WAL")
+        self.conn.execute("pragma synchronous=OFF")
+
+    def _columns(self, observations):
+        """Output names, sqlite types, and values of each column"""
+        names = []
+        types = []
+        values = []
+        for name in observations.dtype.names:
+            col = observations[name]
+            out_name = self.converter.inv_map.get(name, name)
+            if out_name in self.converter.angles_rad2deg:
+                col = np.degrees(col)
+            if out_name in self.converter.angles_hours2deg:
+                col = col * 360.0 / 24.0
+            names.append(out_name)
+            types.append(SQL_TYPES[col.dtype.kind])
+            # sqlite stores NaN as NULL, the same as pandas writes it
+            values.append(col.tolist())
+        return names, types, values
+
+    def append(self, observations):
+        """Add an array of observations (empty_observation dtype) to the observations table"""
+        names, types, values = self._columns(observations)
+        quoted = ['"%s"' % name for name in names]
+        with self.conn:
+            self.conn.execute('create table if not exists "observations" (%s)' %
+                              ", ".join(["%s %s" % (name, sql_type) for name, sql_type in zip(quoted, types)]))
+            insert = 'insert into "observations" (%s) values (%s)' % (", ".join(quoted),
+                                                                     ", ".join(["?"] * len(names)))
+            for start in range(0, observations.size, self.batch_size):
+                end = start + self.batch_size
+                self.conn.executemany(insert, zip(*[col[start:end] for col in values]))
+        self.n_rows += observations.size
+
+    def close(self, info=None, indexes=None):
+        """Make the indexes, write the info table and switch back to a normal journal
+
+        Parameters
+        ----------
+        info : np.array (None)
+            Run info, e.g., from run_info_table. Written the same way obs2opsim does.
+        indexes : list of str (None)
+            Observations table columns to index, e.g., ['observationStartMJD', 'night'].
+        """
+        if indexes is not None:
+            with self.conn:
+                for col in indexes:
+                    self.conn.execute('create index if not exists "%s_indx" on "observations" ("%s")' %
+                                      (col, col))
+        if info is not None:
+            pd.DataFrame(info).to_sql("info", self.conn, if_exists="replace")
+        self.conn.execute("pragma synchronous=FULL")
+        self.conn.execute("pragma journal_mode=DELETE")
+        self.conn.close()
+
+
+def write_opsim(observations, filename, info=None, converter=None, batch_size=100000, indexes=None):
+    """Write observations to a new opsim sqlite file, a faster obs2opsim(delete_past=True)
+
+    Parameters
+    ----------
+    observations : np.array
+        Observations with the empty_observation dtype.
+    filename : str
+        Output file, replaced if it exists.
+    info : np.array (None)
+        Run info table.
+    indexes : list of str (None)
+        Columns to index once the rows are loaded.
+    """
+    writer = OpsimWriter(filename, converter=converter, batch_size=batch_size)
+    writer.append(observations)
+    writer.close(info=info, indexes=indexes)
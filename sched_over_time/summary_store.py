@@ -0,0 +1,145 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Store layout, in one directory:
+# names.json : run names and the interned metric, info label and summary names
+# columns.npy : (n_columns,) int32 metric, info_label, summary ids of each summary stat column
+# values.npy : (n_columns, n_runs) float64, each column contiguous so a query only reads its columns
+NAMES_FILE = "names.json"
+COLUMNS_FILE = "columns.npy"
+VALUES_FILE = "values.npy"
+COLUMNS_DTYPE = [("metric", np.int32), ("info_label", np.int32), ("summary", np.int32)]
+# NULL names in column names, the way the original fast_gather rendered them
+NULL_NAME = "nan"
+
+
+def _save_atomic(filename, save_func):
+    temp_file = filename + ".%i.tmp" % os.getpid()
+    with open(temp_file, "wb") as outfile:
+        save_func(outfile)
+    os.replace(temp_file, filename)
+
+
+def write_store(records, store_dir):
+    """Write long format summary records to a SummaryStore directory
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        run, metric, info_label, summary, value columns, e.g., from
+        fast_gather_summaries.fast_gather_records. If a run has a stat
+        more than once, the last one is kept, as in pivot_records. NULL
+        names are stored as "nan", as in the fast_gather column names.
+    store_dir : str
+        Directory to write, made if needed.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    metric = records["metric"].fillna(NULL_NAME).values.astype(str)
+    info_label = records["info_label"].fillna(NULL_NAME).values.astype(str)
+    summary = records["summary"].fillna(NULL_NAME).values.astype(str)
+    col_names = np.char.add(np.char.add(np.char.add(np.char.add(metric, " "), info_label), " "), summary)
+    run = records["run"].values.astype(str)
+
+    # Keep the last record of each run and column
+    keep = ~pd.DataFrame({"run": run, "col": col_names}).duplicated(keep="last").values
+    metric, info_label, summary = metric[keep], info_label[keep], summary[keep]
+    col_names, run = col_names[keep], run[keep]
+    values = records["value"].values.astype(float)[keep]
+
+    runs, run_index = np.unique(run, return_inverse=True)
+    cols, first, col_index = np.unique(col_names, return_index=True, return_inverse=True)
+    table = np.full((cols.size, runs.size), np.nan)
+    table[col_index, run_index] = values
+
+    # Intern the names of each column
+    columns = np.zeros(cols.size, dtype=COLUMNS_DTYPE)
+    metrics, columns["metric"] = np.unique(metric[first], return_inverse=True)
+    info_labels, columns["info_label"] = np.unique(info_label[first], return_inverse=True)
+    summaries, columns["summary"] = np.unique(summary[first], return_inverse=True)
+
+    names = {"runs": runs.tolist(), "metrics": metrics.tolist(), "info_labels": info_labels.tolist(),
+             "summaries": summaries.tolist()}
+    _save_atomic(os.path.join(store_dir, VALUES_FILE), lambda outfile: np.save(outfile, table))
+    _save_atomic(os.path.join(store_dir, COLUMNS_FILE), lambda outfile: np.save(outfile, columns))
+    # Names last, a reader checks the sizes against them
+    _save_atomic(os.path.join(store_dir, NAMES_FILE),
+                 lambda outfile: outfile.write(json.dumps(names).encode()))
+
+
+class SummaryStore(object):
+    """Query summary stats written by write_store
+
+    Only the names are loaded, the values are memory-mapped, so a query for a few
+    metrics only reads those columns from disk.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory written by write_store.
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, NAMES_FILE)) as infile:
+            names = json.load(infile)
+        self.runs = np.array(names["runs"], dtype=object)
+        self.metrics = np.array(names["metrics"], dtype=object)
+        self.info_labels = np.array(names["info_labels"], dtype=object)
+        self.summaries = np.array(names["summaries"], dtype=object)
+        self.columns = np.load(os.path.join(store_dir, COLUMNS_FILE))
+        self.values = np.load(os.path.join(store_dir, VALUES_FILE), mmap_mode="r")
+        if self.values.shape != (self.columns.size, self.runs.size):
+            raise ValueError("%s is incomplete, values are %s for %i columns and %i runs" %
+                             (store_dir, self.values.shape, self.columns.size, self.runs.size))
+        self._column_names = None
+
+    def column_names(self, indx=None):
+        """"metricName metricInfoLabel summaryName" of the columns (all if indx is None)"""
+        if indx is None:
+            if self._column_names is None:
+                self._column_names = self.column_names(np.arange(self.columns.size))
+            return self._column_names
+        cols = self.columns[indx]
+        return (self.metrics[cols["metric"]] + " " + self.info_labels[cols["info_label"]] + " " +
+                self.summaries[cols["summary"]])
+
+    def select(self, metrics=None, info_labels=None, summaries=None, pattern=None):
+        """Indices of the columns that match all the given selections
+
+        Parameters
+        ----------
+        metrics, info_labels, summaries : list of str (None)
+            Exact names to keep.
+        pattern : str (None)
+            Regular expression searched for in the "metric info_label summary" column names.
+        """
+        good = np.ones(self.columns.size, dtype=bool)
+        for key, names, wanted in [("metric", self.metrics, metrics),
+                                   ("info_label", self.info_labels, info_labels),
+                                   ("summary", self.summaries, summaries)]:
+            if wanted is not None:
+                if isinstance(wanted, str):
+                    wanted = [wanted]
+                ids = np.where(np.isin(names, list(wanted)))[0]
+                good &= np.isin(self.columns[key], ids)
+        if pattern is not None:
+            regex = re.compile(pattern)
+            good &= np.array([regex.search(name) is not None for name in self.column_names()], dtype=bool)
+        return np.where(good)[0]
+
+    def query(self, metrics=None, info_labels=None, summaries=None, pattern=None, runs=None):
+        """Summary stats as a DataFrame, one row per run and one column per stat
+
+        Selections are the same as for select. runs is a list of run names to
+        keep, default is all of them. With no selections this is the same table
+        as fast_gather.
+        """
+        indx = self.select(metrics=metrics, info_labels=info_labels, summaries=summaries,
+                           pattern=pattern)
+        run_indx = np.arange(self.runs.size) if runs is None else np.where(np.isin(self.runs, list(runs)))[0]
+        values = np.asarray(self.values[indx])[:, run_indx]
+        return pd.DataFrame(values.T, index=pd.Index(self.runs[run_indx]),
+                            columns=pd.Index(self.column_names(indx)))
@@ -1,32 +1,323 @@
+import argparse
+import datetime
+import json
 import numpy as np
+import os
 import pandas as pd
 import sqlite3
+import healpy as hp
 from rubin_sim.scheduler.model_observatory import ModelObservatory
 from rubin_sim.scheduler.utils import empty_observation, run_info_table, SchemaConverter
+from rubin_sim.utils import _angular_separation, _ra_dec2_hpid, calc_lmst_last, m5_flat_sed
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from astropy.time import Time
 
+from opsim_writer import OpsimWriter, write_opsim
 
+SKY_FILTERS = ['u', 'g', 'r', 'i', 'z', 'y']
 
-def update_minion(outfile='minion_1016_update.db', 
-                  in_db='minion_1016_sqlite.db',
-                  apply_weather=True, use_dithered=False,
-                  table='Summary',
-                  mjd_name='expMJD', exptime_name='visitExpTime',
-                  radians=True):
-    """Let's update the minion_1016 runs to have the current sky, weather downtime, and throughputs.
+
+def sky_brightness(sky_model, mjd, hpid, filtername, badval=hp.UNSEEN):
+    """Sky brightness for observations in one night, ordered by mjd
+
+    Same values as calling sky_model.return_mags(mjd, indx=[hpid], extrapolate=True)
+    for each observation. Observations that would not take the simple interpolation
+    path in return_mags (maps need loading, a gap longer than timestep_max, masked
+    pixels that need extrapolating) are still sent to return_mags one at a time.
+
+    Parameters
+    ----------
+    sky_model : SkyModelPre
+    mjd : np.array
+        MJDs of the observations, sorted.
+    hpid : np.array
+        Healpix ids of the observations.
+    filtername : np.array
+        Filter of each observation.
     """
+    result = np.empty(mjd.size, dtype=float)
+    # Load the maps the first observation needs, the ones after it that fall in
+    # the loaded range can then be interpolated at once.
+    if (mjd[0] < sky_model.loaded_range.min()) | (mjd[0] > sky_model.loaded_range.max()):
+        sky_model.return_mags(mjd[0], indx=[hpid[0]], extrapolate=True)
+    n_loaded = np.searchsorted(mjd, sky_model.loaded_range.max(), side='right')
 
-    conn = sqlite3.connect(in_db)
-    query = 'select * from %s group by %s order by %s' % (table, mjd_name, mjd_name)
-    df = pd.read_sql(query, conn)
+    left = np.searchsorted(sky_model.mjds, mjd[:n_loaded]) - 1
+    right = left + 1
+    simple = (left >= 0) & (right < sky_model.mjds.size)
+    left[~simple] = 0
+    right[~simple] = 0
+    baseline = sky_model.mjds[right] - sky_model.mjds[left]
+    simple &= baseline <= sky_model.timestep_max + 1e-6
+    baseline[~simple] = 1.
+    wterm = (mjd[:n_loaded] - sky_model.mjds[left]) / baseline
+    w1 = 1.0 - wterm
+    w2 = wterm
 
-    num_obs = df['fieldRA'].size
+    hp_loaded = hpid[:n_loaded]
+    for filter_name in SKY_FILTERS:
+        sb = sky_model.sb[filter_name][left, hp_loaded] * w1 + sky_model.sb[filter_name][right, hp_loaded] * w2
+        # return_mags extrapolates the pixel if it is masked in any filter
+        simple &= (sb != badval) & ~np.isnan(sb)
+        in_filt = filtername[:n_loaded] == filter_name
+        result[:n_loaded][in_filt] = sb[in_filt]
 
-    mo = ModelObservatory(mjd_start=df[mjd_name].min())
-    blank = empty_observation()
+    for i in np.concatenate([np.where(~simple)[0], np.arange(n_loaded, mjd.size)]):
+        result[i] = sky_model.return_mags(mjd[i], indx=[hpid[i]], extrapolate=True)[filtername[i]]
+    return result
+
+
+def observations_add_data(mo, observations):
+    """Fill in the metadata for an array of completed observations
+
+    Vectorized version of mo.observation_add_data, which does one observation at
+    the time set by mo.mjd. Observations should be sorted by mjd. Everything is
+    computed for the whole array except the sky brightness, which is interpolated
+    a night at a time as the sky model loads its maps.
+
+    Parameters
+    ----------
+    mo : ModelObservatory
+    observations : np.array
+        Array with the empty_observation dtype, with RA, dec, mjd, filter,
+        exptime, nexp and alt filled in.
+    """
+    mjd = observations['mjd']
+    current_time = Time(mjd, format='mjd')
+
+    observations['clouds'] = mo.cloud_data(current_time)
+    observations['airmass'] = 1.0 / np.cos(np.pi / 2.0 - observations['alt'])
+
+    # Seeing, the same operations as SeeingModel.__call__ with a single airmass
+    fwhm_500 = mo.seeing_data(current_time)
+    seeing_model = mo.seeing_model
+    airmass_correction = np.power(observations['airmass'], 0.6)
+    wavelen_correction = np.power(seeing_model.raw_seeing_wavelength / seeing_model.eff_wavelens, 0.3)
+    fwhm_system = seeing_model.fwhm_system_zenith * airmass_correction
+    filters = np.unique(observations['filter'])
+    for filtername in filters:
+        in_filt = np.where(observations['filter'] == filtername)[0]
+        fwhm_atmo = (fwhm_500[in_filt] * wavelen_correction[mo.seeing_indx_dict[filtername]] *
+                     airmass_correction[in_filt])
+        fwhm_eff = 1.16 * np.sqrt(fwhm_system[in_filt]**2 + 1.04 * fwhm_atmo**2)
+        observations['FWHMeff'][in_filt] = fwhm_eff
+        observations['FWHM_geometric'][in_filt] = seeing_model.fwhm_eff_to_fwhm_geom(fwhm_eff)
+    observations['FWHM_500'] = fwhm_500
+
+    observations['night'] = mo.almanac.sunsets['night'][mo.almanac.mjd_indx(mjd)]
+
+    if mo.sky_model is not None:
+        hpid = _ra_dec2_hpid(mo.sky_model.nside, observations['RA'], observations['dec'])
+        nights, night_starts = np.unique(observations['night'], return_index=True)
+        night_ends = np.append(night_starts[1:], observations.size)
+        for start, end in zip(night_starts, night_ends):
+            observations['skybrightness'][start:end] = sky_brightness(mo.sky_model, mjd[start:end],
+                                                                      hpid[start:end],
+                                                                      observations['filter'][start:end])
+
+    for filtername in filters:
+        for nexp in np.unique(observations['nexp']):
+            indx = np.where((observations['filter'] == filtername) & (observations['nexp'] == nexp))[0]
+            observations['fivesigmadepth'][indx] = m5_flat_sed(filtername,
+                                                               observations['skybrightness'][indx],
+                                                               observations['FWHMeff'][indx],
+                                                               observations['exptime'][indx] / nexp,
+                                                               observations['airmass'][indx],
+                                                               nexp=nexp)
+
+    lmst, last = calc_lmst_last(mjd, mo.site.longitude_rad)
+    observations['lmst'] = lmst
+
+    sun_moon_info = mo.almanac.get_sun_moon_positions(mjd)
+    observations['sunAlt'] = sun_moon_info['sun_alt']
+    observations['sunAz'] = sun_moon_info['sun_az']
+    observations['sunRA'] = sun_moon_info['sun_RA']
+    observations['sunDec'] = sun_moon_info['sun_dec']
+    observations['moonAlt'] = sun_moon_info['moon_alt']
+    observations['moonAz'] = sun_moon_info['moon_az']
+    observations['moonRA'] = sun_moon_info['moon_RA']
+    observations['moonDec'] = sun_moon_info['moon_dec']
+    observations['moonDist'] = _angular_separation(observations['RA'], observations['dec'],
+                                                   observations['moonRA'], observations['moonDec'])
+    observations['solarElong'] = _angular_separation(observations['RA'], observations['dec'],
+                                                     observations['sunRA'], observations['sunDec'])
+    observations['moonPhase'] = sun_moon_info['moon_phase']
+
+    observations['ID'] = mo.obs_id_counter + np.arange(observations.size)
+    mo.obs_id_counter += observations.size
+    if observations.size > 0:
+        mo.mjd = mjd[-1]
+
+    return observations
+
+
+class Progress(object):
+    """Report the rows done, rows/s and time left, at most every interval seconds
+
+    Parameters
+    ----------
+    total : int
+        Total number of rows.
+    done : int (0)
+        Rows already done, e.g., before a resume. Not counted in the rate.
+    interval : float (10)
+        Seconds between reports.
+    """
+
+    def __init__(self, total, done=0, interval=10.):
+        self.total = total
+        self.done = done
+        self.interval = interval
+        self.start_done = done
+        self.t0 = time.time()
+        self.last_report = self.t0
+
+    def update(self, n_rows=1):
+        self.done += n_rows
+        now = time.time()
+        if now - self.last_report >= self.interval:
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.time()
+        self.last_report = now
+        rate = (self.done - self.start_done) / max(now - self.t0, 1e-9)
+        if rate > 0:
+            eta = str(datetime.timedelta(seconds=int((self.total - self.done) / rate)))
+        else:
+            eta = '?'
+        sys.stdout.write("\r%i of %i rows (%.1f%%), %.0f rows/s, ETA %s" %
+                         (self.done, self.total, self.done / max(self.total, 1) * 100, rate, eta))
+        sys.stdout.flush()
 
-    observations = np.zeros(num_obs, dtype=blank.dtype)
+    def finish(self):
+        self.report()
+        sys.stdout.write("\n")
+
+
+def add_weather(mo, observations, batched=True, progress=None):
+    """Drop the observations taken when it was cloudy, fill in the data for the rest
+
+    Parameters
+    ----------
+    mo : ModelObservatory
+    observations : np.array
+        Observations sorted by mjd.
+    batched : bool (True)
+        Use observations_add_data rather than one mo.observation_add_data call per row.
+    progress : Progress (None)
+        Updated with the number of rows done.
+
+    Returns
+    -------
+    observations : np.array
+        The observations that pass the cloud limit.
+    """
+    if batched:
+        clouds = mo.cloud_data(Time(observations['mjd'], format='mjd'))
+        obs_good = ~(clouds > mo.cloud_limit)
+        observations = observations_add_data(mo, observations[obs_good])
+        if progress is not None:
+            progress.update(obs_good.size)
+        return observations
+    else:
+        num_obs = observations.size
+        obs_good = np.ones(num_obs, dtype=bool)
+        for i, obs in enumerate(observations):
+
+            obs_good[i] = True 
+
+            clouds = mo.cloud_data(Time(obs['mjd'], format='mjd'))
+            if clouds > mo.cloud_limit:
+                obs_good[i] = False
+
+            if obs_good[i]:
+                mo.mjd = obs['mjd']
+
+                observations[i] = mo.observation_add_data(obs)
+
+            if progress is not None:
+                progress.update()
+
+    return observations[np.where(obs_good == True)[0]]
+
+
+# ModelObservatory for each add_weather_parallel worker process
+_worker_mo = None
+
+
+def _init_worker(mjd_start):
+    global _worker_mo
+    _worker_mo = ModelObservatory(mjd_start=mjd_start)
+
+
+def _add_weather_chunk(observations, batched):
+    return add_weather(_worker_mo, observations, batched=batched)
+
+
+def add_weather_parallel(mo, observations, n_workers=4, batched=True, chunks_per_worker=4,
+                         executor=None):
+    """add_weather with the nights split between processes
+
+    Each worker builds its own ModelObservatory once, with the same mjd_start as mo
+    so the weather lines up. The observations are split into contiguous night ranges
+    of about equal size, and the results are put back together in mjd order, so the
+    output does not depend on n_workers.
+
+    Parameters
+    ----------
+    mo : ModelObservatory
+        Used for the mjd_start and to find the nights.
+    observations : np.array
+        Observations sorted by mjd.
+    n_workers : int (4)
+        Number of processes.
+    chunks_per_worker : int (4)
+        Number of night ranges for each worker, so slow chunks do not hold things up.
+    executor : ProcessPoolExecutor (None)
+        Pool made with _init_worker, to reuse the workers between calls. Default
+        is to start a new pool.
+    """
+    if observations.size == 0:
+        return observations
+
+    night = mo.almanac.mjd_indx(observations['mjd'])
+    night_starts = np.where(np.diff(night) != 0)[0] + 1
+    if night_starts.size == 0:
+        # All in one night, nothing to split
+        chunks = [observations]
+    else:
+        targets = np.linspace(0, observations.size, n_workers * chunks_per_worker + 1)[1:-1]
+        splits = np.unique(night_starts[np.searchsorted(night_starts, targets).clip(max=night_starts.size - 1)])
+        chunks = np.split(observations, splits)
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(mo.mjd_start,)) as executor:
+            results = list(executor.map(_add_weather_chunk, chunks, [batched] * len(chunks)))
+    else:
+        results = list(executor.map(_add_weather_chunk, chunks, [batched] * len(chunks)))
+
+    observations = np.concatenate(results)
+    # The workers count IDs on their own, continue the count on mo
+    observations['ID'] = mo.obs_id_counter + np.arange(observations.size)
+    mo.obs_id_counter += observations.size
+    return observations
+
+
+# Columns read from the input database. visitTime is optional.
+BASE_COLUMNS = ['filter', 'slewTime', 'altitude', 'azimuth', 'rotSkyPos', 'rotTelPos']
+NO_WEATHER_COLUMNS = ['airmass', 'FWHMeff', 'FWHMgeom', 'filtSkyBrightness', 'night', 'slewDist',
+                      'fiveSigmaDepth', 'phaseAngle', 'transparency', 'sunAlt']
+
+
+def observations_from_df(df, apply_weather=True, use_dithered=False,
+                         mjd_name='expMJD', exptime_name='visitExpTime', radians=True):
+    """Convert rows of an old opsim table to an array of observations"""
+    observations = np.zeros(df.shape[0], dtype=empty_observation().dtype)
     if use_dithered:
         observations['RA'] = df['ditheredRA']
         observations['dec'] = df['ditheredDec']
@@ -47,32 +338,12 @@ def update_minion(outfile='minion_1016_update.db',
     except:
         observations['visittime'] = df[exptime_name] + 4
 
-    obs_good = np.ones(num_obs, dtype=bool)
-
     if not radians:
         for key in ['RA', 'dec', 'rotSkyPos',
                     'rotTelPos', 'alt', 'az']:
             observations[key] = np.radians(observations[key])
 
-    if apply_weather:
-        for i, obs in enumerate(observations):
-
-            obs_good[i] = True 
-            
-            clouds = mo.cloud_data(Time(obs['mjd'], format='mjd'))
-            if clouds > mo.cloud_limit:
-                obs_good[i] = False
-
-            if obs_good[i]:
-                mo.mjd = obs['mjd']
-
-                observations[i] = mo.observation_add_data(obs)
-
-                progress = i/num_obs*100
-                text = "\rprogress=%.3f%%, %i of %i" % (progress, i, num_obs)
-                sys.stdout.write(text)
-                sys.stdout.flush()
-    else:
+    if not apply_weather:
         observations['airmass'] = df['airmass']
         observations['FWHMeff'] = df['FWHMeff']
         observations['FWHM_geometric'] = df['FWHMgeom']
@@ -84,14 +355,190 @@ def update_minion(outfile='minion_1016_update.db',
         observations['clouds'] = df['transparency']
         observations['sunAlt'] = df['sunAlt']
 
-    observations = observations[np.where(obs_good == True)[0]]
+    return observations
+
+
+def update_minion(outfile='minion_1016_update.db', 
+                  in_db='minion_1016_sqlite.db',
+                  apply_weather=True, use_dithered=False,
+                  table='Summary',
+                  mjd_name='expMJD', exptime_name='visitExpTime',
+                  radians=True, batched=True, n_workers=1, chunk_size=None, resume=False):
+    """Let's update the minion_1016 runs to have the current sky, weather downtime, and throughputs.
+
+    batched : bool (True)
+        Compute the weather and observation data for all the observations at once
+        with observations_add_data, rather than one mo.observation_add_data call per row.
+    n_workers : int (1)
+        Number of processes to split the nights between when applying the weather.
+    chunk_size : int (None)
+        If set, stream the database: read only the needed columns chunk_size rows at
+        a time, in mjd order, and append each converted chunk to outfile. Memory
+        use is then set by chunk_size rather than the size of the database.
+    resume : bool (False)
+        Pick up a streamed conversion from its last checkpoint, see stream_minion.
+        Streams with chunk_size=100000 if chunk_size is not set.
+    """
+    if resume & (chunk_size is None):
+        chunk_size = 100000
+    if chunk_size is not None:
+        return stream_minion(outfile=outfile, in_db=in_db, apply_weather=apply_weather,
+                             use_dithered=use_dithered, table=table, mjd_name=mjd_name,
+                             exptime_name=exptime_name, radians=radians, batched=batched,
+                             n_workers=n_workers, chunk_size=chunk_size, resume=resume)
+
+    conn = sqlite3.connect(in_db)
+    query = 'select * from %s group by %s order by %s' % (table, mjd_name, mjd_name)
+    df = pd.read_sql(query, conn)
+
+    mo = ModelObservatory(mjd_start=df[mjd_name].min())
+    observations = observations_from_df(df, apply_weather=apply_weather, use_dithered=use_dithered,
+                                        mjd_name=mjd_name, exptime_name=exptime_name, radians=radians)
+    del df
+
+    if apply_weather & (n_workers > 1):
+        observations = add_weather_parallel(mo, observations, n_workers=n_workers, batched=batched)
+    elif apply_weather:
+        progress = Progress(observations.size)
+        observations = add_weather(mo, observations, batched=batched, progress=progress)
+        progress.finish()
+
     if outfile is not None:
         info = run_info_table(mo)
-        converter = SchemaConverter()
-        converter.obs2opsim(observations, filename=outfile, info=info, delete_past=True)
+        write_opsim(observations, outfile, info=info)
+
+
+def read_checkpoint(filename):
+    """Load a stream_minion checkpoint, None if there is not one"""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as infile:
+        return json.load(infile)
+
+
+def write_checkpoint(checkpoint, filename):
+    """Write a checkpoint to a temp file and rename it, so a kill never leaves half a file"""
+    temp_file = filename + '.%i.tmp' % os.getpid()
+    with open(temp_file, 'w') as outfile:
+        json.dump(checkpoint, outfile)
+    os.replace(temp_file, filename)
+
+
+def stream_minion(outfile='minion_1016_update.db',
+                  in_db='minion_1016_sqlite.db',
+                  apply_weather=True, use_dithered=False,
+                  table='Summary',
+                  mjd_name='expMJD', exptime_name='visitExpTime',
+                  radians=True, batched=True, n_workers=1, chunk_size=100000,
+                  resume=False, checkpoint_file=None):
+    """update_minion, a chunk of rows at a time
+
+    Same output as update_minion, but only chunk_size rows (plus the ModelObservatory)
+    are in memory at once. Rows are read in mjd order, converted, cut on the weather,
+    and appended to outfile before the next chunk is read.
+
+    After each chunk is committed, the last input mjd, the rows read and the rows
+    written are saved to checkpoint_file. With resume=True, rows written after the
+    checkpoint are dropped from outfile and the conversion carries on from the
+    checkpoint mjd. The checkpoint is deleted once outfile is finished.
+
+    Parameters
+    ----------
+    resume : bool (False)
+        Carry on from checkpoint_file if it exists. Otherwise outfile is started over.
+    checkpoint_file : str (None)
+        Default is outfile + '.checkpoint.json'.
+    """
+    if checkpoint_file is None:
+        checkpoint_file = outfile + '.checkpoint.json'
+    settings = {'in_db': os.path.abspath(in_db), 'table': table, 'mjd_name': mjd_name,
+                'apply_weather': bool(apply_weather), 'use_dithered': bool(use_dithered)}
+
+    conn = sqlite3.connect(in_db)
+    in_columns = [row[1] for row in conn.execute('pragma table_info(%s)' % table)]
+    if use_dithered:
+        columns = ['ditheredRA', 'ditheredDec']
+    else:
+        columns = ['fieldRA', 'fieldDec']
+    columns += [mjd_name, exptime_name] + BASE_COLUMNS
+    if 'visitTime' in in_columns:
+        columns.append('visitTime')
+    if not apply_weather:
+        columns += NO_WEATHER_COLUMNS
+
+    mjd_start, n_rows = conn.execute('select min(%s), count(distinct %s) from %s' %
+                                     (mjd_name, mjd_name, table)).fetchone()
+    mo = ModelObservatory(mjd_start=mjd_start)
+    converter = SchemaConverter()
+
+    checkpoint = read_checkpoint(checkpoint_file) if resume else None
+    if checkpoint is not None:
+        if checkpoint['settings'] != settings:
+            raise ValueError('Checkpoint %s is for %s, not %s' % (checkpoint_file, checkpoint['settings'],
+                                                                 settings))
+        writer = OpsimWriter(outfile, converter=converter, delete_past=False)
+        # Drop anything committed after the checkpoint was saved
+        writer.conn.execute('delete from observations where %s > ?' % converter.inv_map['mjd'],
+                            (checkpoint['last_mjd'],))
+        writer.conn.commit()
+        n_written = writer.conn.execute('select count(*) from observations').fetchone()[0]
+        if n_written != checkpoint['rows_written']:
+            raise ValueError('%s has %i rows, checkpoint says %i' % (outfile, n_written,
+                                                                   checkpoint['rows_written']))
+        mo.obs_id_counter = n_written
+        where = ' where %s > %r' % (mjd_name, checkpoint['last_mjd'])
+    else:
+        checkpoint = {'settings': settings, 'last_mjd': None, 'rows_read': 0, 'rows_written': 0}
+        writer = OpsimWriter(outfile, converter=converter, delete_past=True)
+        where = ''
+    progress = Progress(n_rows, done=checkpoint['rows_read'])
+
+    executor = None
+    if apply_weather & (n_workers > 1):
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                       initargs=(mo.mjd_start,))
+
+    query = 'select %s from %s%s group by %s order by %s' % (', '.join(columns), table, where,
+                                                             mjd_name, mjd_name)
+    for df in pd.read_sql(query, conn, chunksize=chunk_size):
+        observations = observations_from_df(df, apply_weather=apply_weather, use_dithered=use_dithered,
+                                            mjd_name=mjd_name, exptime_name=exptime_name,
+                                            radians=radians)
+        if executor is not None:
+            observations = add_weather_parallel(mo, observations, n_workers=n_workers, batched=batched,
+                                                executor=executor)
+            progress.update(df.shape[0])
+        elif apply_weather:
+            observations = add_weather(mo, observations, batched=batched, progress=progress)
+        else:
+            progress.update(df.shape[0])
+        writer.append(observations)
+
+        checkpoint['last_mjd'] = float(df[mjd_name].iloc[-1])
+        checkpoint['rows_read'] += df.shape[0]
+        checkpoint['rows_written'] += observations.size
+        write_checkpoint(checkpoint, checkpoint_file)
+
+    if executor is not None:
+        executor.shutdown()
+    progress.finish()
+
+    writer.close(info=run_info_table(mo))
+    conn.close()
+    # No checkpoint is written if there were no rows to convert
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_workers", type=int, default=1)
+    parser.add_argument("--chunk_size", type=int, default=None,
+                        help="Stream the database this many rows at a time")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="Carry on from the last checkpoint")
+    args = parser.parse_args()
+
     #update_minion()
     #update_minion(outfile='minion_1016_newschema.db', apply_weather=True, use_dithered=False)
     
@@ -100,6 +547,7 @@ if __name__ == '__main__':
                   apply_weather=True, use_dithered=False,
                   table='SummaryAllProps', mjd_name='observationStartMJD',
                   exptime_name='visitExposureTime',
-                  radians=False)
+                  radians=False, n_workers=args.n_workers,
+                  chunk_size=args.chunk_size, resume=args.resume)
     #update_minion(outfile='opsim3_61_newschema.db', in_db='opsim3_61_sqlite.db',exptime_name='expTime')
 
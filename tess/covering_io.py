@@ -0,0 +1,112 @@
+import glob
+import os
+import struct
+
+import numpy as np
+from rubin_sim.utils import ra_dec_from_xyz
+
+# data files from http://neilsloane.com/icosahedral.codes/index.html
+# Text files are x,y,z values one per line, named icover.3.<n_points>.<h>.<k>.txt
+
+# Binary layout: 32 byte header, then (n, 3) float64 x,y,z and (n, 2) float64 RA,dec (degrees)
+MAGIC = b"ICOV"
+VERSION = 1
+HEADER = struct.Struct("<4sIQII8x")
+
+
+def read_covering_text(filename):
+    """Read a covering text file, return (n, 3) array of x,y,z"""
+    return np.loadtxt(filename, dtype=float).reshape(-1, 3)
+
+
+def write_covering_binary(xyz, filename, h=0, k=0):
+    """Write x,y,z points (and their RA,dec) to the binary covering format
+
+    Written to a temp file and renamed, so readers never see a partial file.
+    """
+    xyz = np.ascontiguousarray(xyz, dtype="<f8")
+    ra_dec = np.ascontiguousarray(np.vstack(ra_dec_from_xyz(xyz[:, 0], xyz[:, 1], xyz[:, 2])).T,
+                                  dtype="<f8")
+    temp_file = filename + ".%i.tmp" % os.getpid()
+    with open(temp_file, "wb") as outfile:
+        outfile.write(HEADER.pack(MAGIC, VERSION, xyz.shape[0], h, k))
+        outfile.write(xyz.tobytes())
+        outfile.write(ra_dec.tobytes())
+    os.replace(temp_file, filename)
+
+
+def read_covering_binary(filename, xyz=False):
+    """Memory-map a binary covering file
+
+    Parameters
+    ----------
+    filename : str
+        File written by write_covering_binary.
+    xyz : bool (False)
+        Return (n, 3) x,y,z rather than (n, 2) RA,dec in degrees (the layout geo returns).
+    """
+    with open(filename, "rb") as infile:
+        magic, version, n_points, h, k = HEADER.unpack(infile.read(HEADER.size))
+    if (magic != MAGIC) | (version != VERSION):
+        raise ValueError("%s is not a version %i covering file" % (filename, VERSION))
+    if xyz:
+        return np.memmap(filename, dtype="<f8", mode="r", offset=HEADER.size, shape=(n_points, 3))
+    return np.memmap(filename, dtype="<f8", mode="r", offset=HEADER.size + n_points * 3 * 8,
+                     shape=(n_points, 2))
+
+
+class CoveringLibrary(object):
+    """Lazily convert and load the icover files by number of points
+
+    Parameters
+    ----------
+    text_dir : str
+        Directory with the icover.3.*.txt files.
+    cache_dir : str (None)
+        Where to put the binary files. Default is text_dir.
+    """
+
+    def __init__(self, text_dir="neilsloane/neilsloane.com/ICOSC", cache_dir=None):
+        self.text_dir = text_dir
+        self.cache_dir = text_dir if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # n_points : list of (h, k, filename), sorted by h, k
+        self.files = {}
+        for filename in glob.glob(os.path.join(text_dir, "icover.3.*.txt")):
+            n_points, h, k = [int(val) for val in os.path.basename(filename).split(".")[2:5]]
+            self.files.setdefault(n_points, []).append((h, k, filename))
+        for key in self.files:
+            self.files[key].sort()
+
+    def available(self):
+        """Sorted list of the available numbers of points"""
+        return sorted(self.files.keys())
+
+    def __call__(self, n_points, h=None, k=None, xyz=False):
+        """Load the covering with n_points
+
+        Parameters
+        ----------
+        n_points : int
+            Number of points in the covering.
+        h, k : int (None)
+            Pick the pattern if there are several coverings with n_points.
+            Default is the one with the smallest h.
+        xyz : bool (False)
+            Return (n, 3) x,y,z rather than (n, 2) RA,dec in degrees.
+        """
+        if n_points not in self.files:
+            raise ValueError("No covering with %i points" % n_points)
+        options = [option for option in self.files[n_points]
+                   if ((h is None) | (option[0] == h)) & ((k is None) | (option[1] == k))]
+        if len(options) == 0:
+            raise ValueError("No covering with %i points and h,k=%s,%s, options are %s" %
+                             (n_points, h, k, [option[:2] for option in self.files[n_points]]))
+        h, k, text_file = options[0]
+
+        bin_file = os.path.join(self.cache_dir, os.path.basename(text_file)[:-len(".txt")] + ".bin")
+        if (not os.path.isfile(bin_file)) or (os.path.getmtime(bin_file) < os.path.getmtime(text_file)):
+            write_covering_binary(read_covering_text(text_file), bin_file, h=h, k=k)
+
+        return read_covering_binary(bin_file, xyz=xyz)
@@ -25,112 +25,12 @@ from rubin_sim.utils import ra_dec_from_xyz
 # THE SOFTWARE.
 
 
-class Vec:
-    def __init__(self, *v):
-        self.v = list(v)
-
-    def fromlist(self, v):
-        if not isinstance(v, list):
-            raise TypeError
-        self.v = v[:]
-        return self
-
-    def copy(self):
-        return Vec().fromlist(self.v)
-
-    def __str__(self):
-        return '(' + repr(self.v)[1:-1] + ')'
-
-    def __repr__(self):
-        return 'Vec(' + repr(self.v)[1:-1] + ')'
-
-    def __len__(self):
-        return len(self.v)
-
-    def __getitem__(self, key):
-        if not isinstance(key, int):
-            raise TypeError
-        if key < 0 or key >= len(self.v):
-            raise KeyError
-        return self.v[key]
-
-    def __setitem__(self, key, value):
-        if not isinstance(key, int):
-            raise TypeError
-        if key < 0 or key >= len(self.v):
-            raise KeyError
-        self.v[key] = value
-
-    # Element-wise negation
-    def __neg__(self):
-        v = list(map(lambda x: -x, self.v))
-        return Vec().fromlist(v)
-
-    # Element-wise addition
-    def __add__(self, other):
-        v = list(map(lambda x, y: x+y, self.v, other.v))
-        return Vec().fromlist(v)
-
-    # Element-wise subtraction
-    def __sub__(self, other):
-        v = list(map(lambda x, y: x-y, self.v, other.v))
-        return Vec().fromlist(v)
-
-    # Element-wise multiplication by scalar
-    def __mul__(self, scalar):
-        v = list(map(lambda x: x*scalar, self.v))
-        return Vec().fromlist(v)
-
-    # Element-wise pre-multiplication by scalar
-    def __rmul__(self, scalar):
-        return self.__mul__(scalar)
-
-    # Element-wise division by scalar
-    def __truediv__(self, scalar):
-        return self.__mul__(1/scalar)
-
-    # Vector magnitude/length squared
-    def mag2(self):
-        return self.dot(self, self)
-
-    # Vector magnitude/length
-    def mag(self):
-        return math.sqrt(self.mag2())
-
-    # Vector as unit
-    def unit(self):
-        return self.__truediv__(self.mag())
-
-    # Vector rotated about z-axis
-    def rot_z(self, ang):
-        r = math.sqrt(self.v[0]**2+self.v[1]**2)
-        initial_ang = math.atan2(self.v[1], self.v[0])
-        final_ang = initial_ang + ang
-        return Vec(r*math.cos(final_ang), r*math.sin(final_ang), self.v[2])
-
-    # Cross product v0 x v1
-    @staticmethod
-    def cross(v0, v1):
-        return Vec(v1[2]*v0[1] - v1[1]*v0[2],
-                   v1[0]*v0[2] - v1[2]*v0[0],
-                   v1[1]*v0[0] - v1[0]*v0[1])
-
-    # Dot product v0 . v1
-    @staticmethod
-    def dot(v0, v1):
-        return sum(map(lambda x, y: x*y, v0.v, v1.v))
-
-    # Triple product v0. (v1 x v2)
-    @staticmethod
-    def triple(v0, v1, v2):
-        return Vec.dot(v0, Vec.cross(v1, v2))
-
 def get_octahedron(verts, faces):
     """Return an octahedron"""
     X = 0.25 * math.sqrt(2)
-    verts.extend([Vec(0.0, 0.5, 0.0), Vec(X, 0.0, -X),
-                  Vec(X, 0.0, X), Vec(-X, 0.0, X),
-                  Vec(-X, 0.0, -X), Vec(0.0, -0.5, 0.0)])
+    verts.extend([(0.0, 0.5, 0.0), (X, 0.0, -X),
+                  (X, 0.0, X), (-X, 0.0, X),
+                  (-X, 0.0, -X), (0.0, -0.5, 0.0)])
 
     faces.extend([(0, 1, 2), (0, 2, 3), (0, 3, 4), (0, 4, 1),
                   (5, 2, 1), (2, 5, 3), (3, 5, 4), (4, 5, 1)])
@@ -139,8 +39,8 @@ def get_octahedron(verts, faces):
 def get_tetrahedron(verts, faces):
     """Return an tetrahedron"""
     X = 1 / math.sqrt(3)
-    verts.extend([Vec(-X, X, -X), Vec(-X, -X, X),
-                  Vec(X, X, X), Vec(X, -X, -X)])
+    verts.extend([(-X, X, -X), (-X, -X, X),
+                  (X, X, X), (X, -X, -X)])
     faces.extend([(0, 1, 2), (0, 3, 1), (0, 2, 3), (2, 1, 3)])
 
 
@@ -156,23 +56,23 @@ def get_triangle(verts, faces):
     if 1:
         Y = math.sqrt(3.0) / 12.0
         Z = -0.8
-        verts.extend([Vec(-0.25, -Y, Z), Vec(0.25, -Y, Z),
-                      Vec(0.0, 2 * Y, Z)])
+        verts.extend([(-0.25, -Y, Z), (0.25, -Y, Z),
+                      (0.0, 2 * Y, Z)])
         faces.extend([(0, 1, 2)])
     else:
         X, Z = get_ico_coords()
-        verts.extend([Vec(-X, 0.0, -Z), Vec(X, 0.0, -Z),
-                      Vec(0.0, Z, -X), Vec(0.0, -Z, -X)])
+        verts.extend([(-X, 0.0, -Z), (X, 0.0, -Z),
+                      (0.0, Z, -X), (0.0, -Z, -X)])
         faces.extend([(0, 1, 2), (0, 3, 1)])
 
 
 def get_icosahedron(verts, faces):
     """Return an icosahedron"""
     X, Z = get_ico_coords()
-    verts.extend([Vec(-X, 0.0, Z), Vec(X, 0.0, Z), Vec(-X, 0.0, -Z),
-                  Vec(X, 0.0, -Z), Vec(0.0, Z, X), Vec(0.0, Z, -X),
-                  Vec(0.0, -Z, X), Vec(0.0, -Z, -X), Vec(Z, X, 0.0),
-                  Vec(-Z, X, 0.0), Vec(Z, -X, 0.0), Vec(-Z, -X, 0.0)])
+    verts.extend([(-X, 0.0, Z), (X, 0.0, Z), (-X, 0.0, -Z),
+                  (X, 0.0, -Z), (0.0, Z, X), (0.0, Z, -X),
+                  (0.0, -Z, X), (0.0, -Z, -X), (Z, X, 0.0),
+                  (-Z, X, 0.0), (Z, -X, 0.0), (-Z, -X, 0.0)])
 
     faces.extend([(0, 4, 1), (0, 9, 4), (9, 5, 4), (4, 5, 8), (4, 8, 1),
                   (8, 10, 1), (8, 3, 10), (5, 3, 8), (5, 2, 3), (2, 7, 3),
@@ -207,62 +107,83 @@ def get_poly(poly, verts, edges, faces):
     return 1
 
 
+def edge_steps(edge_vec, freq, div_by_len):
+    """Divide an edge vector into freq steps, return (freq + 1, 3) array"""
+    result = np.zeros((freq + 1, 3))
+    steps = np.arange(1, freq + 1, dtype=float)[:, np.newaxis]
+    if div_by_len:
+        result[1:] = edge_vec * steps * (1 / freq)
+    else:
+        mag = math.sqrt(edge_vec[0]**2 + edge_vec[1]**2 + edge_vec[2]**2)
+        ang = 2 * math.asin(mag / 2.0)
+        unit_edge_vec = edge_vec * (1 / mag)
+        lengths = [math.sin(i * ang / freq) /
+                   math.sin(math.pi / 2 + ang / 2 - i * ang / freq)
+                   for i in range(1, freq + 1)]
+        result[1:] = unit_edge_vec * np.array(lengths)[:, np.newaxis]
+    return result
+
+
 def grid_to_points(grid, freq, div_by_len, f_verts, face):
-    """Convert grid coordinates to Cartesian coordinates"""
-    points = []
-    v = []
-    for vtx in range(3):
-        v.append([Vec(0.0, 0.0, 0.0)])
-        edge_vec = f_verts[(vtx + 1) % 3] - f_verts[vtx]
-        if div_by_len:
-            for i in range(1, freq + 1):
-                v[vtx].append(edge_vec * float(i) / freq)
-        else:
-            ang = 2 * math.asin(edge_vec.mag() / 2.0)
-            unit_edge_vec = edge_vec.unit()
-            for i in range(1, freq + 1):
-                len = math.sin(i * ang / freq) / \
-                    math.sin(math.pi / 2 + ang / 2 - i * ang / freq)
-                v[vtx].append(unit_edge_vec * len)
-
-    for (i, j) in grid.values():
-
-        if (i == 0) + (j == 0) + (i + j == freq) == 2:   # skip vertex
-            continue
-        # skip edges in one direction
-        if (i == 0 and face[2] > face[0]) or (
-                j == 0 and face[0] > face[1]) or (
-                i + j == freq and face[1] > face[2]):
-            continue
-
-        n = [i, j, freq - i - j]
-        v_delta = (v[0][n[0]] + v[(0-1) % 3][freq - n[(0+1) % 3]] -
-                   v[(0-1) % 3][freq])
-        pt = f_verts[0] + v_delta
-        if not div_by_len:
-            for k in [1, 2]:
-                v_delta = (v[k][n[k]] + v[(k-1) % 3][freq - n[(k+1) % 3]] -
-                           v[(k-1) % 3][freq])
-                pt = pt + f_verts[k] + v_delta
-            pt = pt / 3
-        points.append(pt)
+    """Convert grid coordinates to Cartesian coordinates
+
+    Parameters
+    ----------
+    grid : np.array (n, 2)
+        Integer grid coordinates from make_grid
+    freq : int
+        Pattern frequency
+    div_by_len : bool
+        Divide the edges by equal lengths rather than equal angles
+    f_verts : np.array (3, 3)
+        x,y,z of the face vertices
+    face : tuple of int
+        Vertex indices of the face, used to only generate shared
+        edge points on one of the faces.
+
+    Returns
+    -------
+    points : np.array (m, 3)
+    """
+    v = [edge_steps(f_verts[(vtx + 1) % 3] - f_verts[vtx], freq, div_by_len)
+         for vtx in range(3)]
+
+    i = grid[:, 0]
+    j = grid[:, 1]
+    # skip vertex
+    good = ((i == 0).astype(int) + (j == 0) + (i + j == freq)) != 2
+    # skip edges in one direction
+    if face[2] > face[0]:
+        good &= i != 0
+    if face[0] > face[1]:
+        good &= j != 0
+    if face[1] > face[2]:
+        good &= i + j != freq
+
+    n = [i[good], j[good], freq - i[good] - j[good]]
+    v_delta = (v[0][n[0]] + v[(0-1) % 3][freq - n[(0+1) % 3]] -
+               v[(0-1) % 3][freq])
+    points = f_verts[0] + v_delta
+    if not div_by_len:
+        for k in [1, 2]:
+            v_delta = (v[k][n[k]] + v[(k-1) % 3][freq - n[(k+1) % 3]] -
+                       v[(k-1) % 3][freq])
+            points = points + f_verts[k] + v_delta
+        points = points * (1 / 3)
 
     return points
 
 
 def make_grid(freq, m, n):
-    """Make the geodesic pattern grid"""
-    grid = {}
+    """Make the geodesic pattern grid, return (n, 2) array of grid coordinates"""
     rng = (2 * freq) // (m + n)
-    for i in range(rng):
-        for j in range(rng):
-            x = i * (-n) + j * (m + n)
-            y = i * (m + n) + j * (-m)
+    i, j = np.meshgrid(np.arange(rng), np.arange(rng), indexing='ij')
+    x = (i * (-n) + j * (m + n)).ravel()
+    y = (i * (m + n) + j * (-m)).ravel()
 
-            if x >= 0 and y >= 0 and x + y <= freq:
-                grid[(i, j)] = (x, y)
+    good = (x >= 0) & (y >= 0) & (x + y <= freq)
 
-    return grid
+    return np.vstack([x[good], y[good]]).T
 
 
 def geo(repeats=1, polyhedron="i", class_pattern=[1, 0, 1],
@@ -288,34 +209,41 @@ def geo(repeats=1, polyhedron="i", class_pattern=[1, 0, 1],
     to_ra_dec : bool (True)
         Convert from x,y,z coordinates to RA,dec in degrees.
         Default True
+
+    Returns
+    -------
+    points : np.array
+        (n, 2) array of RA,dec if to_ra_dec, otherwise (n, 3) array of x,y,z.
     """
     verts = []
     edges = {}
     faces = []
     get_poly(polyhedron, verts, edges, faces)
+    verts = np.array(verts, dtype=float)
 
     (M, N, reps) = class_pattern
     repeats = repeats * reps
     freq = repeats * (M**2 + M*N + N**2)
 
-    grid = {}
     grid = make_grid(freq, M, N)
 
-    points = verts
+    points = [verts]
     for face in faces:
         if polyhedron == 'T':
             face_edges = (0, 0, 0)  # generate points for all edges
         else:
             face_edges = face
-        points[len(points):len(points)] = grid_to_points(
-            grid, freq, equal_length,
-            [verts[face[i]] for i in range(3)], face_edges)
+        points.append(grid_to_points(grid, freq, equal_length,
+                                     verts[list(face)], face_edges))
+    points = np.concatenate(points)
 
     if not flat_faced:
-        points = [p.unit() for p in points]  # Project onto sphere
+        # Project onto sphere
+        mag = np.sqrt(points[:, 0]**2 + points[:, 1]**2 + points[:, 2]**2)
+        points = points * (1 / mag)[:, np.newaxis]
 
     if to_ra_dec:
-        points = np.vstack([ra_dec_from_xyz(p[0], p[1], p[2]) for p in points])
+        points = np.vstack(ra_dec_from_xyz(points[:, 0], points[:, 1], points[:, 2])).T
 
     return points
 
@@ -323,54 +251,364 @@ def geo(repeats=1, polyhedron="i", class_pattern=[1, 0, 1],
 
 # https://github.com/antiprism/antiprism_python/blob/master/anti_lib_progs/sph_spiral.py
 
+# 5 point Gauss-Legendre nodes and weights on [0, 1]
+_GL_NODES, _GL_WEIGHTS = np.polynomial.legendre.leggauss(5)
+_GL_NODES = (_GL_NODES + 1) / 2
+_GL_WEIGHTS = _GL_WEIGHTS / 2
+
+
 def angle_to_point(a, number_turns):
+    """x,y,z of points on the spiral at angle(s) a from the y axis, (n, 3) array"""
+    a = np.atleast_1d(a)
     a2 = 2 * a * number_turns   # angle turned around y axis
-    r = math.sin(a)             # distance from y axis
-    y = math.cos(a)
-    x = r * math.sin(a2)
-    z = r * math.cos(a2)
-    return Vec(x, y, z)
-
-
-# binary search for angle with distance rad from point with angle a0
-def psearch(a1_delt, a1, a0, rad, number_turns):
-    a_test = a1_delt + (a1 - a1_delt) / 2.0
-    dist = (angle_to_point(a_test, number_turns) -
-            angle_to_point(a0, number_turns)).mag()
-    eps = 1e-5
-    if rad + eps > dist > rad - eps:
-        return a_test
-    elif rad < dist:      # Search in first interval
-        return psearch(a1_delt, a_test, a0, rad, number_turns)
-    else:                 # Search in second interval
-        return psearch(a_test, a1, a0, rad, number_turns)
-
-
-def calc_points(number_turns=10, distance_between_points=None):
-    points = []
-    number_turns = number_turns
-    if not number_turns:
-        number_turns = 1e-12
-    if distance_between_points:
-        rad = 2*distance_between_points
-    else:
-        # half distance between turns on a rad 1 sphere
-        rad = 2*math.sqrt(1 - math.cos(math.pi/(number_turns-1)))
-    a0 = 0
-    cur_point = Vec(0.0, 1.0, 0.0)
-    points.append(cur_point)
+    r = np.sin(a)               # distance from y axis
+    y = np.cos(a)
+    x = r * np.sin(a2)
+    z = r * np.cos(a2)
+    return np.vstack([x, y, z]).T
+
+
+def spiral_speed(a, number_turns):
+    """Arc length per unit angle along the spiral, d(arc)/da"""
+    return np.sqrt(1 + (2 * number_turns * np.sin(a))**2)
+
+
+def spiral_curvature(a, number_turns):
+    """Curvature of the spiral at angle(s) a"""
+    b = 2 * number_turns * a
+    sin_a, cos_a = np.sin(a), np.cos(a)
+    sin_b, cos_b = np.sin(b), np.cos(b)
+    n2 = 2 * number_turns
+    d1 = np.stack([cos_a * sin_b + n2 * sin_a * cos_b,
+                   -sin_a,
+                   cos_a * cos_b - n2 * sin_a * sin_b], axis=-1)
+    d2 = np.stack([-(1 + n2**2) * sin_a * sin_b + 2 * n2 * cos_a * cos_b,
+                   -cos_a,
+                   -(1 + n2**2) * sin_a * cos_b - 2 * n2 * cos_a * sin_b], axis=-1)
+    speed = spiral_speed(a, number_turns)
+    return np.linalg.norm(np.cross(d1, d2), axis=-1) / speed**3
+
+
+def spiral_density(a, number_turns, rad):
+    """Number of points per unit angle for a chord of rad between points
+
+    Uses the arc length of a chord of length rad on the osculating
+    circle, so points stay about rad apart where the spiral is tightly
+    curved. Within a chord of rad of a pole, the spiral curls up too
+    much for that, so the density is set to put exactly one step
+    between the pole and the edge of the cap. Only used for a first
+    guess, spiral_angles solves the chords exactly.
+    """
+    curvature = spiral_curvature(a, number_turns)
+    half_chord = np.minimum(rad * curvature / 2, 1)
+    step = 2 * np.arcsin(half_chord) / curvature
+    result = spiral_speed(a, number_turns) / step
+
+    cap = 2 * np.arcsin(min(rad / 2, 1))
+    result[(a < cap) | (a > np.pi - cap)] = 1 / cap
+    return result
+
+
+def _cell_integral(a0, a1, func):
+    """Integrate func over [a0, a1] (arrays) with Gauss-Legendre quadrature"""
+    width = a1 - a0
+    angles = a0[:, np.newaxis] + width[:, np.newaxis] * _GL_NODES
+    return width * np.sum(func(angles) * _GL_WEIGHTS, axis=1)
+
+
+def chord_squared(a0, a1, number_turns):
+    """Squared chord between the points at angles a0 and a1 on the spiral
+
+    Written as 4 (sin^2(d/2) + sin(a0) sin(a1) sin^2(n d)), with d = a1 - a0,
+    so short chords don't lose precision.
+
+    Returns
+    -------
+    chord2, d_a0, d_a1 : float or np.array
+        The squared chord and its derivatives with respect to a0 and a1.
+    """
+    d = a1 - a0
+    sin_0, sin_1 = np.sin(a0), np.sin(a1)
+    turn2 = np.sin(number_turns * d)**2
+    cross = number_turns * sin_0 * sin_1 * np.sin(2 * number_turns * d)
+    chord2 = 4 * (np.sin(d / 2)**2 + sin_0 * sin_1 * turn2)
+    d_a0 = 4 * (-np.sin(d) / 2 + np.cos(a0) * sin_1 * turn2 - cross)
+    d_a1 = 4 * (np.sin(d) / 2 + sin_0 * np.cos(a1) * turn2 + cross)
+    return chord2, d_a0, d_a1
+
+
+def _chord_squared_scalar(a0, a1, number_turns):
+    """chord_squared for floats, without the derivatives"""
+    d = a1 - a0
+    return 4 * (math.sin(d / 2)**2 + math.sin(a0) * math.sin(a1) * math.sin(number_turns * d)**2)
+
 
+def chord_walk(a0, rad, number_turns, stop=np.pi, end=np.pi, n_max=None, tol=1e-14):
+    """Step along the spiral from a0, each point a chord of rad from the last
+
+    As in the original sph_spiral: step forward in angle until the chord
+    from the last point is longer than rad, then bisect for the point at
+    exactly rad. This takes the first crossing where the spiral curls up
+    near the poles.
+
+    Parameters
+    ----------
+    a0 : float
+        Angle of the starting point, not included in the output.
+    rad : float
+        Chord length between points.
+    number_turns : float
+        Number of turns of the spiral.
+    stop : float (pi)
+        Stop once a point is past this angle.
+    end : float (pi)
+        Don't step past this angle, the south pole unless the spiral is
+        continued through it.
+    n_max : int (None)
+        Stop after this many points.
+    tol : float (1e-14)
+        Tolerance on the angles.
+
+    Returns
+    -------
+    angles : list of float
+    """
+    angles = []
+    rad2 = rad**2
     delt = math.atan(rad / 2) / 10
-    a1 = a0 + .0999999 * delt                        # still within sphere
-    while a1 < math.pi:
-        if (cur_point - angle_to_point(a1, number_turns)).mag() > rad:
-            a0 = psearch(a1 - delt, a1, a0, rad, number_turns)
-            cur_point = angle_to_point(a0, number_turns)
-            points.append(cur_point)
+    a1 = a0 + delt
+    while (a1 < end) and (len(angles) != n_max):
+        if _chord_squared_scalar(a0, a1, number_turns) > rad2:
+            low, high = a1 - delt, a1
+            while high - low > tol:
+                mid = (low + high) / 2
+                if _chord_squared_scalar(a0, mid, number_turns) > rad2:
+                    high = mid
+                else:
+                    low = mid
+            a0 = (low + high) / 2
+            angles.append(a0)
+            if a0 > stop:
+                break
             a1 = a0
-
         a1 += delt
+    return angles
+
+
+def forward_substitution(shifts, factors, block_size=256):
+    """Solve delta[k] = shifts[k] + factors[k] * delta[k - 1], with delta[-1] = 0
+
+    Each block of block_size is solved at once with cumulative products
+    and sums, only the carry from one block to the next is a loop.
+    """
+    n = shifts.size
+    n_blocks = -(-n // block_size)
+    pad = n_blocks * block_size - n
+    shifts = np.concatenate([shifts, np.zeros(pad)]).reshape(n_blocks, block_size)
+    factors = np.concatenate([factors, np.ones(pad)]).reshape(n_blocks, block_size)
+
+    # Within a block, delta[k] = prod[k] * (carry + sum(shifts[j] / prod[j], j <= k))
+    prod = np.cumprod(factors, axis=1)
+    local = prod * np.cumsum(shifts / prod, axis=1)
+    carry = np.zeros(n_blocks)
+    for b in range(1, n_blocks):
+        carry[b] = local[b - 1, -1] + prod[b - 1, -1] * carry[b - 1]
+    return (local + prod * carry[:, np.newaxis]).ravel()[:n]
+
+
+def refine_chain(a_start, angles, rad, number_turns, tol=1e-13, max_iter=20):
+    """Newton's method for angles each a chord of rad from the one before
+
+    The chord of each point only depends on it and the point before, so
+    the Jacobian is lower bidiagonal and each Newton step is a
+    forward_substitution. Stops at tol, or once rounding keeps the chords from
+    getting any closer to rad.
+
+    Parameters
+    ----------
+    a_start : float
+        Angle of the fixed point before the first one.
+    angles : np.array
+        First guess of the angles.
+    tol : float (1e-13)
+        Tolerance on the squared chords, relative to rad^2.
+    """
+    angles = np.array(angles, dtype=float)
+    rad2 = rad**2
+    last_worst = np.inf
+    for i in range(max_iter):
+        previous = np.concatenate([[a_start], angles[:-1]])
+        chord2, d_previous, d_angle = chord_squared(previous, angles, number_turns)
+        diff = chord2 - rad2
+        worst = np.max(np.abs(diff), initial=0)
+        if (worst < tol * rad2) or (worst > last_worst / 2):
+            break
+        last_worst = worst
+        angles = angles + forward_substitution(-diff / d_angle, -d_previous / d_angle)
+    return angles
+
+
+def spiral_angles(number_turns, rad=None, n_points=None, tol=1e-10, max_iter=20):
+    """Angles of points spaced a chord of rad apart along a spherical spiral
+
+    Within a few chords of the poles, where the spiral curls up, points
+    are stepped one at a time with chord_walk. In between, the point
+    count along the spiral, N(a), is integrated from the point density
+    on a grid, and N(a_k) = k is solved for all the points at once with
+    Newton's method on the cubic Hermite interpolation of N. Those
+    angles are then polished with refine_chain so every chord is rad.
+
+    Parameters
+    ----------
+    number_turns : float
+        Number of times the spiral goes around the y axis.
+    rad : float (None)
+        Chord length between points on the unit sphere.
+    n_points : int (None)
+        Number of points, spread from pole to pole. Used if rad is None.
+        The last one is on the south pole, so its chord can be short.
+    tol : float (1e-10)
+        Tolerance on N(a) of the first guess.
+    max_iter : int (20)
+        Maximum number of Newton (and secant) iterations, and of walks for n_points.
+    """
+    # Grid fine enough to resolve how the density changes along the spiral
+    n_grid = int(64 * max(number_turns, 1) + 1024)
+    a_grid = np.linspace(0, np.pi, n_grid + 1)
+    step = a_grid[1]
+
+    def counts(rad):
+        result = np.zeros(a_grid.size)
+        result[1:] = np.cumsum(_cell_integral(a_grid[:-1], a_grid[1:],
+                                              lambda a: spiral_density(a, number_turns, rad)))
+        return result
+
+    def solve_counts(targets, n_along, density):
+        angles = np.interp(targets, n_along, a_grid)
+        last_worst = np.inf
+        for i in range(max_iter):
+            indx = np.clip((angles / step).astype(int), 0, n_grid - 1)
+            t = angles / step - indx
+            t2 = t * t
+            t3 = t2 * t
+            n_at = ((2 * t3 - 3 * t2 + 1) * n_along[indx] + (t3 - 2 * t2 + t) * step * density[indx] +
+                    (-2 * t3 + 3 * t2) * n_along[indx + 1] + (t3 - t2) * step * density[indx + 1])
+            slope = ((6 * t2 - 6 * t) * (n_along[indx] - n_along[indx + 1]) / step +
+                     (3 * t2 - 4 * t + 1) * density[indx] + (3 * t2 - 2 * t) * density[indx + 1])
+            diff = n_at - targets
+            # N gets large, so rounding can keep it from reaching tol
+            worst = np.max(np.abs(diff), initial=0)
+            if (worst < tol) or (worst > last_worst / 2):
+                break
+            last_worst = worst
+            angles = np.clip(angles - diff / slope, 0, np.pi)
+        return angles
+
+    def walk(rad, n_max=None):
+        # Step the points within a few chords of the poles, where the density is a poor guess
+        polar = np.arcsin(min(4 * rad, 1))
+        angles = [0.] + chord_walk(0., rad, number_turns, stop=polar, n_max=n_max)
+        if angles[-1] < np.pi - polar:
+            n_along = counts(rad)
+            density = spiral_density(a_grid, number_turns, rad)
+            start = np.interp(angles[-1], a_grid, n_along)
+            # Guess a little past the south cap, the chain can end up shorter than the guess
+            end = np.interp(np.pi - polar / 2, a_grid, n_along)
+            targets = np.arange(start + 1, end)
+            if targets.size > 0:
+                middle = refine_chain(angles[-1], solve_counts(targets, n_along, density), rad,
+                                      number_turns)
+                angles.extend(middle[middle <= np.pi - polar].tolist())
+        if n_max is None:
+            angles.extend(chord_walk(angles[-1], rad, number_turns))
+        elif len(angles) <= n_max:
+            # Carry on through the south pole, the spiral is smooth there
+            angles.extend(chord_walk(angles[-1], rad, number_turns, end=2 * np.pi,
+                                     n_max=n_max + 1 - len(angles)))
+        return np.array(angles[:None if n_max is None else n_max + 1])
+
+    if rad is not None:
+        return walk(rad)
+
+    if n_points is None:
+        raise ValueError("Need rad or n_points")
+    if n_points < 2:
+        raise ValueError("n_points must be at least 2 to go from pole to pole, got %s" % n_points)
+
+    if n_points == 2:
+        return np.array([0., np.pi])
+
+    # Secant iterations on log(rad) until the density has n_points - 1 steps pole to pole.
+    # The number of points goes roughly as 1/rad^2.
+    log_rads = [np.log(np.pi / np.sqrt(n_points))]
+    log_rads.append(log_rads[0] - 0.1)
+    diffs = [np.log(counts(np.exp(log_rad))[-1] / (n_points - 1)) for log_rad in log_rads]
+    for i in range(max_iter):
+        if np.abs(diffs[-1]) < 1e-12:
+            break
+        log_rads.append(log_rads[-1] - diffs[-1] * (log_rads[-1] - log_rads[-2]) / (diffs[-1] - diffs[-2]))
+        diffs.append(np.log(counts(np.exp(log_rads[-1]))[-1] / (n_points - 1)))
+
+    # One exact walk usually has n_points - 1 points before the south pole,
+    # otherwise correct rad from how many steps the walk took pole to pole
+    log_rad = log_rads[-1]
+    # Bounds where the walk had too many (low) or too few (high) points
+    low, high = -np.inf, np.log(2)
+    for i in range(max_iter):
+        angles = walk(np.exp(log_rad))
+        if angles.size == n_points - 1:
+            # The south pole is within rad of the last point
+            return np.append(angles, np.pi)
+        if angles.size > n_points - 1:
+            low = log_rad
+        else:
+            high = log_rad
+        if angles.size > 1:
+            steps = angles.size - 1 + (np.pi - angles[-1]) / (angles[-1] - angles[-2])
+            log_rad = log_rad + 0.5 * np.log(steps / (n_points - 1))
+        if not (low < log_rad < high):
+            log_rad = (low + high) / 2 if np.isfinite(low) else high - 0.1
+
+    # The count jumped over n_points - 1 where the spiral curls up. Take the
+    # sparser walk on through the pole, and move its last point onto the pole.
+    angles = walk(np.exp(high), n_max=n_points - 1)
+    angles[-1] = np.pi
+    return angles
+
+
+def calc_points(number_turns=10, distance_between_points=None, n_points=None):
+    """Points along a spiral from pole to pole
+
+    Parameters
+    ----------
+    number_turns : float (10)
+        Number of turns of the spiral.
+    distance_between_points : float (None)
+        Half the spacing between points, radians. If None, the spacing
+        is set so the points are as far apart as the turns of the spiral.
+    n_points : int (None)
+        Number of points to spread evenly along the spiral, at least 2.
+        The last one is on the south pole, no further than the spacing
+        from the one before. Overrides distance_between_points.
+
+    Returns
+    -------
+    points : np.array (n, 2)
+        RA,dec in degrees.
+    """
+    if not number_turns:
+        number_turns = 1e-12
+    if n_points is not None:
+        angles = spiral_angles(number_turns, n_points=n_points)
+    else:
+        if distance_between_points:
+            rad = 2*distance_between_points
+        else:
+            # half distance between turns on a rad 1 sphere
+            rad = 2*math.sqrt(1 - math.cos(math.pi/(number_turns-1)))
+        angles = spiral_angles(number_turns, rad=rad)
+
+    points = angle_to_point(angles, number_turns)
+    points = np.vstack(ra_dec_from_xyz(points[:, 0], points[:, 1], points[:, 2])).T
 
-    points = np.vstack([ra_dec_from_xyz(p[0], p[1], p[2]) for p in points])
-    
     return points
@@ -0,0 +1,122 @@
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+
+from geodesic import geo, calc_points
+
+
+class TessCache(object):
+    """On-disk cache of tessellations, so they only get generated once
+
+    Each result is saved as a .npy file next to a .json manifest of
+    the parameters that made it, named by a hash of the function name
+    and parameters. Results are loaded memory-mapped, so many processes
+    can share the same file. Writes go to a temp file and are renamed
+    into place, so a reader never sees a partial file.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to store the cached tessellations in.
+    max_bytes : int (1e9)
+        Maximum size of the .npy files in the cache. When exceeded, the
+        least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1e9):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.functions = {"geo": geo, "calc_points": calc_points}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _params(self, func_name, args, kwargs):
+        """Bind the arguments, including defaults, so equivalent calls have the same key"""
+        bound = inspect.signature(self.functions[func_name]).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return {"function": func_name, "params": dict(bound.arguments)}
+
+    def _key(self, manifest):
+        return hashlib.sha1(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+
+    def get(self, func_name, *args, **kwargs):
+        """Return the result of func_name(*args, **kwargs), generating and saving it if needed
+
+        Parameters
+        ----------
+        func_name : str
+            "geo" or "calc_points"
+        """
+        manifest = self._params(func_name, args, kwargs)
+        root = os.path.join(self.cache_dir, self._key(manifest))
+        data_file = root + ".npy"
+        manifest_file = root + ".json"
+
+        if os.path.isfile(manifest_file):
+            try:
+                result = np.load(data_file, mmap_mode="r")
+                # Touch the manifest to mark it as recently used
+                os.utime(manifest_file)
+                return result
+            except FileNotFoundError:
+                # Evicted by someone else between the check and the load
+                pass
+
+        points = np.asarray(self.functions[func_name](*args, **kwargs))
+        manifest["shape"] = list(points.shape)
+        manifest["dtype"] = points.dtype.str
+        manifest["created"] = time.time()
+
+        temp_root = root + ".%i.tmp" % os.getpid()
+        np.save(temp_root + ".npy", points)
+        with open(temp_root + ".json", "w") as outfile:
+            json.dump(manifest, outfile, indent=1)
+        # Data first, so a manifest always has its data file
+        os.replace(temp_root + ".npy", data_file)
+        os.replace(temp_root + ".json", manifest_file)
+
+        # Load before evicting, an open memmap survives the file being deleted
+        result = np.load(data_file, mmap_mode="r")
+        self.evict()
+
+        return result
+
+    def geo(self, *args, **kwargs):
+        """Cached version of geodesic.geo"""
+        return self.get("geo", *args, **kwargs)
+
+    def calc_points(self, *args, **kwargs):
+        """Cached version of geodesic.calc_points"""
+        return self.get("calc_points", *args, **kwargs)
+
+    def entries(self):
+        """Return list of (last used time, size in bytes, root path) for the cache entries"""
+        result = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".json") or ".tmp" in filename:
+                continue
+            root = os.path.join(self.cache_dir, filename[:-len(".json")])
+            try:
+                last_used = os.path.getmtime(root + ".json")
+                size = os.path.getsize(root + ".npy")
+            except FileNotFoundError:
+                continue
+            result.append((last_used, size, root))
+        return result
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under max_bytes"""
+        entries = sorted(self.entries())
+        total = np.sum([entry[1] for entry in entries])
+        for last_used, size, root in entries:
+            if total <= self.max_bytes:
+                break
+            for ext in [".json", ".npy"]:
+                try:
+                    os.remove(root + ext)
+                except FileNotFoundError:
+                    pass
+            total -= size
@@ -0,0 +1,121 @@
+import numpy as np
+from scipy.spatial import ConvexHull
+
+from tile_index import TileIndex
+
+
+def covering_radius_sampled(index, n_samples=10000000, chunk_size=1000000, seed=42):
+    """Estimate the covering radius by sampling the sphere
+
+    Random points are drawn uniformly on the sphere in chunks, and
+    the largest distance to their nearest tile is kept. This is a lower
+    bound on the true covering radius.
+
+    Parameters
+    ----------
+    index : TileIndex
+        Index of the tessellation.
+    n_samples : int (1e7)
+        Total number of points to sample.
+    chunk_size : int (1e6)
+        Number of points to sample at once, sets the memory use.
+    seed : int (42)
+        Random number seed.
+
+    Returns
+    -------
+    radius : float
+        Covering radius estimate (degrees).
+    ra, dec : float
+        Position of the point furthest from any tile (degrees).
+    """
+    rng = np.random.default_rng(seed)
+    radius = 0.
+    ra_max, dec_max = None, None
+    n_done = 0
+    while n_done < n_samples:
+        n_chunk = int(min(chunk_size, n_samples - n_done))
+        ra = rng.uniform(0, 360., n_chunk)
+        dec = np.degrees(np.arcsin(rng.uniform(-1., 1., n_chunk)))
+        indx, dist = index.nearest(ra, dec)
+        worst = np.argmax(dist)
+        if dist[worst] > radius:
+            radius = dist[worst]
+            ra_max, dec_max = ra[worst], dec[worst]
+        n_done += n_chunk
+    return radius, ra_max, dec_max
+
+
+def covering_radius_exact(index):
+    """Covering radius from the convex hull of the tile unit vectors
+
+    The point on the sphere furthest from any tile is a vertex of the
+    spherical Voronoi diagram, which is the outward normal of a face
+    of the convex hull. Only works if the points are not all in one
+    hemisphere, returns None in that case.
+
+    Returns
+    -------
+    radius : float
+        Covering radius (degrees).
+    """
+    xyz = index.tree.data
+    hull = ConvexHull(xyz)
+    normals = hull.equations[:, :3]
+    offsets = hull.equations[:, 3]
+    # The origin needs to be inside the hull
+    if np.max(offsets) >= 0:
+        return None
+    cos_radius = np.sum(normals * xyz[hull.simplices[:, 0]], axis=1)
+    return np.degrees(np.arccos(np.clip(np.min(cos_radius), -1, 1)))
+
+
+def evaluate_tessellation(points, n_samples=10000000, chunk_size=1000000, seed=42):
+    """Covering and packing statistics for a set of points on the sphere
+
+    Parameters
+    ----------
+    points : np.array (n, 2) or TileIndex
+        RA,dec in degrees, e.g., from geo or calc_points.
+    n_samples : int (1e7)
+        Number of random points for the sampled covering radius. Only
+        used if the exact convex hull method can not be used.
+
+    Returns
+    -------
+    result : dict
+        n_points, covering radius (degrees), nearest neighbor distance
+        statistics (degrees), packing density (fraction of the sphere covered
+        by non-overlapping caps of half the minimum spacing) and covering
+        density (total area of caps of the covering radius over the area
+        of the sphere).
+    """
+    if isinstance(points, TileIndex):
+        index = points
+    else:
+        index = TileIndex(points)
+    n_points = index.ra.size
+
+    covering_radius = covering_radius_exact(index)
+    if covering_radius is None:
+        covering_radius = covering_radius_sampled(index, n_samples=n_samples,
+                                                  chunk_size=chunk_size, seed=seed)[0]
+
+    # Nearest neighbor of each point, other than itself
+    indx, dist = index.k_nearest(index.ra, index.dec, k=2)
+    nn_dist = dist[:, 1]
+
+    def cap_fraction(radius):
+        """Fraction of the sphere covered by n_points caps of radius (degrees)"""
+        return n_points * (1 - np.cos(np.radians(radius))) / 2
+
+    result = {"n_points": n_points,
+              "covering_radius": covering_radius,
+              "nn_min": np.min(nn_dist),
+              "nn_max": np.max(nn_dist),
+              "nn_mean": np.mean(nn_dist),
+              "nn_median": np.median(nn_dist),
+              "nn_std": np.std(nn_dist),
+              "packing_density": cap_fraction(np.min(nn_dist) / 2),
+              "covering_density": cap_fraction(covering_radius)}
+    return result
@@ -0,0 +1,86 @@
+import pickle
+
+import numpy as np
+from scipy.spatial import cKDTree
+from rubin_sim.utils import _xyz_from_ra_dec
+
+
+def _chord_to_angle(chord):
+    """Convert chord length on the unit sphere to angle in degrees"""
+    return np.degrees(2 * np.arcsin(np.clip(chord / 2, 0, 1)))
+
+
+def _angle_to_chord(angle):
+    """Convert angle in degrees to chord length on the unit sphere"""
+    return 2 * np.sin(np.radians(angle) / 2)
+
+
+class TileIndex(object):
+    """KD-tree on the unit vectors of a tessellation, for assigning pointings to tiles
+
+    Parameters
+    ----------
+    points : np.array (n, 2)
+        RA,dec of the tile centers in degrees, as returned by geo or calc_points.
+    leafsize : int (16)
+        Leaf size of the KD-tree.
+    """
+
+    def __init__(self, points, leafsize=16):
+        points = np.asarray(points)
+        self.ra = np.array(points[:, 0], dtype=float)
+        self.dec = np.array(points[:, 1], dtype=float)
+        self.tree = cKDTree(self._xyz(self.ra, self.dec), leafsize=leafsize)
+
+    @staticmethod
+    def _xyz(ra, dec):
+        """(n, 3) array of unit vectors from RA,dec in degrees"""
+        x, y, z = _xyz_from_ra_dec(np.radians(np.atleast_1d(ra)), np.radians(np.atleast_1d(dec)))
+        return np.vstack([x, y, z]).T
+
+    def nearest(self, ra, dec):
+        """Nearest tile to each RA,dec (degrees)
+
+        Returns
+        -------
+        indx : np.array of int
+            Index of the nearest tile.
+        dist : np.array
+            Angular distance to the tile (degrees).
+        """
+        chord, indx = self.tree.query(self._xyz(ra, dec), k=1, workers=-1)
+        return indx, _chord_to_angle(chord)
+
+    def k_nearest(self, ra, dec, k=4):
+        """The k nearest tiles to each RA,dec (degrees)
+
+        Returns
+        -------
+        indx : np.array (n, k) of int
+            Indices of the tiles, closest first.
+        dist : np.array (n, k)
+            Angular distances to the tiles (degrees).
+        """
+        chord, indx = self.tree.query(self._xyz(ra, dec), k=k, workers=-1)
+        return indx, _chord_to_angle(chord)
+
+    def within(self, ra, dec, radius):
+        """Tiles within radius (degrees) of each RA,dec (degrees)
+
+        Returns
+        -------
+        indx : np.array of objects
+            Each element is a list of tile indices.
+        """
+        return self.tree.query_ball_point(self._xyz(ra, dec), _angle_to_chord(radius), workers=-1)
+
+    def save(self, filename):
+        """Pickle the index, tree included, to filename"""
+        with open(filename, "wb") as outfile:
+            pickle.dump(self, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename):
+        """Load a TileIndex saved with save"""
+        with open(filename, "rb") as infile:
+            return pickle.load(infile)
@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import numpy as np
+
+from uno import Dealer, BasePlayer, CommonColor
+from uno_vec import VecDealer
+
+
+class ListDeck(object):
+    """The old list deck, drawing with pop(0), for comparison"""
+    def __init__(self, cards):
+        self.cards = cards
+
+    def shuffle(self, rng):
+        rng.shuffle(self.cards)
+
+    def draw(self):
+        return self.cards.pop(0)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def refill(self, discard_pile, rng):
+        rng.shuffle(discard_pile)
+        self.cards = discard_pile
+        return []
+
+
+class ListDealer(Dealer):
+    deck_class = ListDeck
+
+
+def games_per_second(dealer, n_games):
+    t0 = time.time()
+    wins = dealer(n_games=n_games).copy()
+    return n_games / (time.time() - t0), wins
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_games", type=int, default=2000)
+    parser.add_argument("--n_vec_games", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("n_players  list deck (games/s)  Deck (games/s)  VecDealer (games/s)")
+    for n_players in range(2, 11):
+        players = [BasePlayer([]) if i % 2 == 0 else CommonColor([]) for i in range(n_players)]
+        rate_list, wins_list = games_per_second(ListDealer(players), args.n_games)
+        rate_deck, wins_deck = games_per_second(Dealer(players), args.n_games)
+        rate_vec, wins_vec = games_per_second(VecDealer(players), args.n_vec_games)
+        if not np.array_equal(wins_list, wins_deck):
+            raise ValueError("Deck and list deck should give the same wins")
+        print("%9i  %19.0f  %14.0f  %19.0f" % (n_players, rate_list, rate_deck, rate_vec))
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from uno import Dealer
+from uno_vec import VecDealer
+
+
+def wilson_interval(wins, n_games, z):
+    """Wilson score interval for win fractions
+
+    Parameters
+    ----------
+    wins : np.array
+        Number of wins for each player.
+    n_games : int
+        Number of games played.
+    z : float
+        Number of standard deviations for the interval.
+    """
+    p = wins / n_games
+    denom = 1 + z**2 / n_games
+    center = (p + z**2 / (2 * n_games)) / denom
+    half_width = z * np.sqrt(p * (1 - p) / n_games + z**2 / (4 * n_games**2)) / denom
+    return center - half_width, center + half_width
+
+
+def tournament(players, alpha=0.05, precision=None, batch_size=500, max_games=100000,
+               vectorized=False, n_workers=1, seed=42, verbose=False):
+    """Play uno games in batches until the best player is clear
+
+    After each batch, win fraction confidence intervals are computed
+    for every player. Because the intervals are checked after every batch,
+    the error rate is spent over the looks: look k uses
+    alpha / (k (k + 1)), which sums to alpha, and is split between the
+    players (Bonferroni), so the overall chance of a wrong call is at most alpha.
+
+    Parameters
+    ----------
+    players : list
+        Player objects (or classes if vectorized).
+    alpha : float (0.05)
+        Significance level. Stop once the leader's interval is above
+        every other player's interval.
+    precision : float (None)
+        If set, also stop once every interval half-width is below precision.
+    batch_size : int (500)
+        Number of games to play between checks.
+    max_games : int (100000)
+        Stop after this many games regardless.
+    vectorized : bool (False)
+        Use VecDealer rather than Dealer.
+    n_workers : int (1)
+        Number of processes for Dealer. One pool is used for the whole tournament.
+    seed : int (42)
+        Random number seed.
+    verbose : bool (False)
+        Print the intervals after each batch.
+
+    Returns
+    -------
+    result : dict
+        wins, n_games, win_frac, ci_low, ci_high, leader (index or None),
+        stop_reason, wall_time (s), and games_per_second.
+    """
+    if vectorized:
+        dealer = VecDealer(players, seed=seed)
+    else:
+        dealer = Dealer(players, seed=seed)
+    n_players = len(players)
+
+    t0 = time.time()
+    executor = None
+    if (not vectorized) & (n_workers > 1):
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+    n_games = 0
+    look = 0
+    stop_reason = "max_games"
+    leader = None
+    while n_games < max_games:
+        n_batch = min(batch_size, max_games - n_games)
+        if vectorized:
+            wins = dealer(n_games=n_batch)
+        else:
+            wins = dealer(n_games=n_batch, n_workers=n_workers, executor=executor)
+        n_games += n_batch
+        look += 1
+
+        alpha_look = alpha / (look * (look + 1)) / n_players
+        z = NormalDist().inv_cdf(1 - alpha_look / 2)
+        ci_low, ci_high = wilson_interval(wins, n_games, z)
+
+        if verbose:
+            print("%i games, win fractions %s +/- %s" % (n_games, np.round(wins / n_games, 4),
+                                                        np.round((ci_high - ci_low) / 2, 4)))
+
+        best = np.argmax(wins)
+        others = np.arange(n_players) != best
+        if ci_low[best] > np.max(ci_high[others]):
+            leader = best
+            stop_reason = "significant"
+            break
+        if (precision is not None) and (np.max((ci_high - ci_low) / 2) < precision):
+            stop_reason = "precision"
+            break
+
+    if executor is not None:
+        executor.shutdown()
+    wall_time = time.time() - t0
+    result = {"wins": wins.copy(),
+              "n_games": n_games,
+              "win_frac": wins / n_games,
+              "ci_low": ci_low,
+              "ci_high": ci_high,
+              "leader": leader,
+              "stop_reason": stop_reason,
+              "wall_time": wall_time,
+              "games_per_second": n_games / wall_time}
+    return result
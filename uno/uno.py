@@ -1,10 +1,16 @@
+import inspect
 import numpy as np
 import random
+from concurrent.futures import ProcessPoolExecutor
+
+
+COLORS = 'rgby'
 
 
 class Card(object):
     """
-    object for an uno card
+    object for an uno card. Cards are immutable, the 108 cards of a deck
+    are made once (CARDS) and shared.
 
     Parameters
     ----------
@@ -14,23 +20,44 @@ class Card(object):
         The color of the card ('r', 'g', 'b', 'y' or None)
     action : str (None)
         The action of the card ('wild', 'wild+4', '+2', 'skip', 'reverse')
+    card_id : int (None)
+        Index of the card in CARDS
     """
-    def __init__(self, number=None, color=None, action=None, wild=False):
-        self.number = number
-        self.color = color
-        self.action = action
-        self.wild = wild
+    __slots__ = ('number', 'color', 'action', 'wild', 'card_id')
+
+    def __init__(self, number=None, color=None, action=None, wild=False, card_id=None):
+        for name, value in zip(self.__slots__, [number, color, action, wild, card_id]):
+            object.__setattr__(self, name, value)
 
-    def playable(self, other_card):
+    def __setattr__(self, name, value):
+        raise AttributeError("Card objects are immutable, pick the color of a wild card in "
+                             "the player's pick_wild_color")
+
+    def __reduce__(self):
+        # Unpickle to the shared card
+        if self.card_id is not None:
+            return (_get_card, (self.card_id,))
+        return (Card, (self.number, self.color, self.action, self.wild))
+
+    def playable(self, other_card, other_color=None):
         """Is the card playable on an other card?
+
+        Parameters
+        ----------
+        other_card : Card
+            The up card
+        other_color : str (None)
+            The color picked if the up card is wild
         """
+        if other_color is None:
+            other_color = other_card.color
         if (self.number is not None) & (self.number == other_card.number):
             return True
         if self.action == 'wild':
             return True
         if self.action == 'wild+4':
             return True
-        if (self.color is not None) & (self.color == other_card.color):
+        if (self.color is not None) & (self.color == other_color):
             return True
         if (self.action is not None) & (self.action == other_card.action):
             return True
@@ -51,16 +78,196 @@ class Card(object):
         return self.__str__()
 
 
+def _make_cards():
+    """Make the 108 cards of a standard UNO deck
+    """
+    cards = []
+    for color in COLORS:
+        # zero to 9
+        for number in range(10):
+            cards.append((number, color, None, False))
+        # 1 to 9
+        for number in range(1, 10):
+            cards.append((number, color, None, False))
+        # Generate 2 of each action card in each color
+        for action in ['+2', 'skip', 'reverse']:
+            for i in range(2):
+                cards.append((None, color, action, False))
+    # 4 of each wild card
+    for action in ['wild', 'wild+4']:
+        for i in range(4):
+            cards.append((None, None, action, True))
+
+    return tuple(Card(*card, card_id=i) for i, card in enumerate(cards))
+
+
+CARDS = _make_cards()
+N_CARDS = len(CARDS)
+
+
+def _get_card(card_id):
+    return CARDS[card_id]
+
+
+# A wild up card with its picked color, for players that only take the up card
+COLORED_WILDS = {(action, color): Card(color=color, action=action, wild=True)
+                 for action in ['wild', 'wild+4'] for color in COLORS}
+
+
+def _make_playable():
+    """PLAYABLE[i, j] is True if card i can be played on up state j
+
+    Used by VecDealer. The up state is the card id for regular cards. A wild
+    card plays like any other wild card of the picked color, so those
+    are N_CARDS + color index.
+    """
+    states = list(CARDS) + [Card(color=color, action='wild', wild=True) for color in COLORS]
+    return np.array([[card.playable(state) for state in states] for card in CARDS])
+
+
+PLAYABLE = _make_playable()
+
+
+def _bucket_keys(card):
+    """Keys of the Hand buckets a card goes in"""
+    result = []
+    if card.color is not None:
+        result.append(('color', card.color))
+    if card.number is not None:
+        result.append(('number', card.number))
+    if card.action is not None:
+        result.append(('action', card.action))
+    if card.wild:
+        result.append(('wild', True))
+    return tuple(result)
+
+
+BUCKET_KEYS = {card: _bucket_keys(card) for card in CARDS}
+
+
+class Hand(object):
+    """A hand of cards, bucketed by color, number, and action
+
+    Acts like a list of Card objects (append, pop, iterate, index), but
+    also keeps each bucket in hand order and a count of each color, so
+    the first playable card and the most common color are found without
+    scanning the hand.
+
+    Parameters
+    ----------
+    cards : list of Card objects (None)
+        Starting cards
+    """
+    def __init__(self, cards=None):
+        self._counter = 0
+        # card : order added. dicts keep insertion order, and cards only go on the end
+        self._cards = {}
+        # (kind, value) : {card : order added}
+        self.buckets = {}
+        self.color_counts = {color: 0 for color in COLORS}
+        if cards is not None:
+            self.extend(cards)
+
+    def append(self, card):
+        keys = BUCKET_KEYS.get(card)
+        if keys is None:
+            keys = _bucket_keys(card)
+        self._cards[card] = self._counter
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = {}
+            bucket[card] = self._counter
+        if card.color is not None:
+            self.color_counts[card.color] += 1
+        self._counter += 1
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def remove(self, card):
+        del self._cards[card]
+        keys = BUCKET_KEYS.get(card)
+        if keys is None:
+            keys = _bucket_keys(card)
+        for key in keys:
+            del self.buckets[key][card]
+        if card.color is not None:
+            self.color_counts[card.color] -= 1
+
+    def pop(self, indx=-1):
+        card = self[indx]
+        self.remove(card)
+        return card
+
+    def __getitem__(self, indx):
+        return list(self._cards)[indx]
+
+    def __iter__(self):
+        return iter(list(self._cards))
+
+    def __len__(self):
+        return len(self._cards)
+
+    def __contains__(self, card):
+        return card in self._cards
+
+    def __repr__(self):
+        return 'Hand(%s)' % list(self._cards)
+
+    def first_playable(self, up_card, up_color=None):
+        """The first card in hand order that can be played on up_card, or None
+
+        Only the first card of the matching number, color, action and
+        wild buckets need to be checked.
+        """
+        if up_color is None:
+            up_color = up_card.color
+        result = None
+        first = None
+        for key in (('wild', True), ('color', up_color), ('number', up_card.number),
+                    ('action', up_card.action)):
+            bucket = self.buckets.get(key)
+            if bucket:
+                card = next(iter(bucket))
+                if (first is None) or (bucket[card] < first):
+                    first = bucket[card]
+                    result = card
+        return result
+
+    def majority_color(self, order='rbgy'):
+        """The color with the most cards, ties go to the first in order"""
+        result = order[0]
+        for color in order[1:]:
+            if self.color_counts[color] > self.color_counts[result]:
+                result = color
+        return result
+
+
 class BasePlayer(object):
     """A single player. Subclass to add new strategies.
 
+    Subclasses with the older __call__(self, up_card) still work, the dealer
+    gives them a wild up card with its picked color set. Cards can no longer
+    be changed though, so rather than setting the color of a wild card to
+    play, return it and let the dealer ask pick_wild_color.
+
     hand : list of Card objects
-        The starting hand
+        The starting hand. Stored as a Hand, which acts like a list.
 
     """
     def __init__(self, hand):
         self.hand = hand
 
+    @property
+    def hand(self):
+        return self._hand
+
+    @hand.setter
+    def hand(self, cards):
+        self._hand = cards if isinstance(cards, Hand) else Hand(cards)
+
     def pick_wild_color(self):
         """Logic for picking wild card color
 
@@ -69,23 +276,17 @@ class BasePlayer(object):
         # Just always pick blue!
         return 'b'
 
-    def __call__(self, up_card):
+    def __call__(self, up_card, up_color=None):
         """Call on the player to take a turn
+
+        Returns the card to play, or None. If the card is wild, the
+        dealer asks pick_wild_color for the color.
         """
-        # Check which cards are possible
-        possible_cards = [card.playable(up_card) for card in self.hand]
+        card_to_play = self.hand.first_playable(up_card, up_color)
 
         # if we have no possible cards to play, return None
-        if not any(possible_cards):
-            return None
-        
-        indx = np.min(np.where(possible_cards)[0])
-
-        card_to_play = self.hand.pop(indx)
-
-        if card_to_play.wild:
-            color_choice = self.pick_wild_color()
-            card_to_play.color = color_choice
+        if card_to_play is not None:
+            self.hand.remove(card_to_play)
 
         return card_to_play
 
@@ -97,49 +298,89 @@ class CommonColor(BasePlayer):
 
         Eventually, need to have a way to pass in info about opponent's hands so this can play defense
         """
-
-        color_hist = {'r': 0, 'b': 0, 'g': 0, 'y': 0}
-        for card in self.hand:
-            if card.color is not None:
-                color_hist[card.color] += 1
-
-        winner = np.max(list(color_hist.values()))
-
         # Just take the first color that has the most cards
-        for key in color_hist:
-            if color_hist[key] == winner:
-                return key
+        return self.hand.majority_color(order='rbgy')
 
 
 def generate_deck():
     """Generate a standard UNO deck, return a list of Card objects
     """
-    deck = []
-    for color in 'rgby':
-        # zero to 9
-        for number in range(10):
-            deck.append(Card(number=number, color=color))
-        # 1 to 9
-        for number in range(1, 10):
-            deck.append(Card(number=number, color=color))
-        # Generate 2 of each action card in each color
-        for action in ['+2', 'skip', 'reverse']:
-            for i in range(2):
-                deck.append(Card(color=color, action=action))
-    # 4 of each wild card
-    for action in ['wild', 'wild+4']:
-        for i in range(4):
-            deck.append(Card(action=action, wild=True))
+    return list(CARDS)
+
+
+class Deck(object):
+    """Cards to draw from. A list with a head pointer, so drawing is O(1).
+
+    Parameters
+    ----------
+    cards : list of Card objects
+        The cards, drawn from the front.
+    """
+    def __init__(self, cards):
+        self.cards = cards
+        self.head = 0
+
+    def shuffle(self, rng):
+        """Shuffle the undrawn cards in place"""
+        if self.head > 0:
+            del self.cards[:self.head]
+            self.head = 0
+        rng.shuffle(self.cards)
+
+    def draw(self):
+        """Take the top card. Raises IndexError if the deck is empty."""
+        card = self.cards[self.head]
+        self.head += 1
+        return card
+
+    def __len__(self):
+        return len(self.cards) - self.head
+
+    def refill(self, discard_pile, rng):
+        """Shuffle the discard pile in place and use it as the deck
+
+        Returns the old, emptied, card list to reuse as the discard pile.
+        """
+        rng.shuffle(discard_pile)
+        old_cards = self.cards
+        old_cards.clear()
+        self.cards = discard_pile
+        self.head = 0
+        return old_cards
 
-    return deck
+
+_TAKES_UP_COLOR = {}
+
+
+def takes_up_color(player):
+    """Does the player's __call__ take up_color, or only the up card?
+
+    Checked once for each player class.
+    """
+    cls = type(player)
+    if cls not in _TAKES_UP_COLOR:
+        try:
+            params = inspect.signature(player).parameters.values()
+        except (TypeError, ValueError):
+            params = []
+        positional = [param for param in params
+                      if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD)]
+        _TAKES_UP_COLOR[cls] = ((len(positional) > 1) or
+                                any(param.kind == param.VAR_POSITIONAL for param in params))
+    return _TAKES_UP_COLOR[cls]
 
 
 class Dealer(object):
     """A dealer to keep track of who wins
     """
+    deck_class = Deck
 
     def __init__(self, players, seed=42):
-        random.seed(seed)
+        # Each game gets its own random stream spawned from the seed, so results
+        # don't depend on how games are split between processes, and dealers
+        # don't share the global random state.
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = random.Random(seed)
 
         self.players = players
         # track how many wins each player gets
@@ -149,9 +390,7 @@ class Dealer(object):
         """shuffle discard pile if deck is empty
         """
         if len(deck) == 0:
-            random.shuffle(discard_pile)
-            deck = discard_pile
-            discard_pile = []
+            discard_pile = deck.refill(discard_pile, self.rng)
         return deck, discard_pile
 
     def play_game(self, n_start=7, draw_max=4):
@@ -163,13 +402,13 @@ class Dealer(object):
         n_players = len(self.players)
 
         # shuffle up a fresh deck
-        deck = generate_deck()
-        random.shuffle(deck)
+        deck = self.deck_class(generate_deck())
+        deck.shuffle(self.rng)
 
         # and deal
         for player in self.players:
             for i in range(n_start):
-                player.hand.append(deck.pop(0))
+                player.hand.append(deck.draw())
 
         lengths = 1
         turn_indx = 0
@@ -181,26 +420,40 @@ class Dealer(object):
         discard_pile = []
 
         # flip the top card
-        top_card = deck.pop(0)
+        top_card = deck.draw()
         # need to make sure it's not a wild
         while top_card.wild:
             discard_pile.append(top_card)
-            top_card = deck.pop(0)
+            top_card = deck.draw()
+        top_color = top_card.color
+
+        takes_color = [takes_up_color(player) for player in self.players]
 
         counter = 0
         # Play until someone is out of cards
-        while np.min(lengths) > 0:
+        while lengths > 0:
+            player_indx = turn_indx
+            player = self.players[player_indx]
             draw_counter = 0
             played_card = None
             while (draw_counter < draw_max) & (played_card is None):
-                played_card = self.players[turn_indx](top_card)
+                if takes_color[turn_indx]:
+                    played_card = self.players[turn_indx](top_card, top_color)
+                elif top_card.wild:
+                    played_card = self.players[turn_indx](COLORED_WILDS[(top_card.action, top_color)])
+                else:
+                    played_card = self.players[turn_indx](top_card)
                 draw_counter += 1
                 if played_card is None:
-                    self.players[turn_indx].hand.append(deck.pop(0))
+                    self.players[turn_indx].hand.append(deck.draw())
                     # Every time we take a card from the deck, see if we need to reshuffle
                     deck, discard_pile = self._reshuffle(deck, discard_pile)
 
             if played_card is not None:
+                if played_card.wild:
+                    played_color = self.players[turn_indx].pick_wild_color()
+                else:
+                    played_color = played_card.color
                 if played_card.action is not None:
                     indx_hit = (turn_indx + direction) % n_players
                     if played_card.action == 'skip':
@@ -212,15 +465,15 @@ class Dealer(object):
                             turn_indx += 1
                     elif played_card.action == '+2':
                         for i in range(2):
-                            self.players[indx_hit].hand.append(deck.pop(0))
+                            self.players[indx_hit].hand.append(deck.draw())
                             deck, discard_pile = self._reshuffle(deck, discard_pile)
                     elif played_card.action == 'wild+4':
                         for i in range(4):
-                            self.players[indx_hit].hand.append(deck.pop(0))
+                            self.players[indx_hit].hand.append(deck.draw())
                             deck, discard_pile = self._reshuffle(deck, discard_pile)
 
-            # how many cards does each player have
-            lengths = [len(player.hand) for player in self.players]
+            # how many cards does the player have. No one else can run out this turn.
+            lengths = len(player.hand)
 
             # advance whose turn it is.
             turn_indx = (turn_indx + direction) % n_players 
@@ -228,19 +481,64 @@ class Dealer(object):
             #if counter > 5:
             #    import pdb ; pdb.set_trace()
             if played_card is not None:
-                # reset wild color if needed
-                if top_card.wild:
-                    top_card.color = None
                 discard_pile.append(top_card)
                 top_card = played_card
+                top_color = played_color
         # Someone has no cards in their hand, they win.
-        winner = np.where(np.array(lengths) == 0)[0]
+        winner = np.array([player_indx])
         return winner
 
-    def __call__(self, n_games=100, n_start=7):
-        for i in range(n_games):
+    def game_seeds(self, n_games):
+        """Spawn a seed for each of the next n_games games"""
+        return [int(child.generate_state(1, dtype=np.uint64)[0])
+                for child in self.seed_sequence.spawn(n_games)]
+
+    def play_games(self, seeds, n_start=7):
+        """Play a game for each seed, return array of wins"""
+        wins = np.zeros(len(self.players), dtype=int)
+        for seed in seeds:
+            self.rng = random.Random(seed)
             indx = self.play_game(n_start=n_start)
-            self.wins[indx] += 1
+            wins[indx] += 1
+        return wins
+
+    def __call__(self, n_games=100, n_start=7, n_workers=1, executor=None):
+        """Play n_games games
+
+        Parameters
+        ----------
+        n_games : int (100)
+            Number of games to play.
+        n_start : int (7)
+            Number of cards dealt to each player.
+        n_workers : int (1)
+            Number of processes to play the games with. The wins are
+            the same for any number of workers.
+        executor : ProcessPoolExecutor (None)
+            Pool to play the games in, to reuse the workers between calls.
+            Default is to start a new pool if n_workers > 1.
+        """
+        seeds = self.game_seeds(n_games)
+        if (n_workers == 1) & (executor is None):
+            self.wins += self.play_games(seeds, n_start=n_start)
+        else:
+            # Split by index, the seeds are too large for numpy ints
+            bounds = np.linspace(0, n_games, min(n_workers * 4, max(n_games, 1)) + 1).astype(int)
+            chunks = [seeds[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            # Build the same class of dealer in the workers, subclasses may change play_game or deck_class
+            args = ([type(self)] * len(chunks), [self.players] * len(chunks), chunks, [n_start] * len(chunks))
+            if executor is None:
+                with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                    results = list(executor.map(_play_games, *args))
+            else:
+                results = list(executor.map(_play_games, *args))
+            for wins in results:
+                self.wins += wins
 
         return self.wins
 
+
+def _play_games(dealer_class, players, seeds, n_start):
+    """Play games in a worker process with a dealer_class dealer"""
+    return dealer_class(players).play_games(seeds, n_start=n_start)
+
@@ -0,0 +1,243 @@
+import numpy as np
+
+from uno import BasePlayer, CommonColor, CARDS, COLORS, N_CARDS, PLAYABLE
+
+# Integer encoding of the cards in CARDS
+ACTIONS = ["+2", "skip", "reverse", "wild", "wild+4"]
+PLUS2, SKIP, REVERSE, WILD, WILD4 = range(len(ACTIONS))
+
+# Where a card is, if not in a player's hand (owner >= 0)
+DECK = -1
+DISCARD = -2
+TOP = -3
+
+
+def encode_deck():
+    """Encode CARDS as integer arrays
+
+    Returns
+    -------
+    number, color, action : np.array of int
+        -1 where the card has no number, color, or action.
+    wild : np.array of bool
+    """
+    deck = CARDS
+    number = np.array([-1 if card.number is None else card.number for card in deck])
+    color = np.array([-1 if card.color is None else COLORS.index(card.color) for card in deck])
+    action = np.array([-1 if card.action is None else ACTIONS.index(card.action) for card in deck])
+    wild = np.array([card.wild for card in deck])
+    return number, color, action, wild
+
+
+class VecDealer(object):
+    """Play many games of uno at once with numpy arrays
+
+    Same rules as Dealer.play_game, but every game in a batch advances
+    one turn at a time in lockstep. Cards are integer ids, and each
+    card's owner and the time it joined a hand are tracked in (n_games, 108)
+    arrays, so "play the first playable card in the hand" is an argmin
+    over the cards allowed by the PLAYABLE row of the up card.
+    BasePlayer and CommonColor are run as vectorized policies.
+
+    One difference: if a player needs to draw when the deck and discard
+    pile are both empty, Dealer raises an IndexError while VecDealer
+    skips the draw. The discard pile is shuffled in whenever a draw finds
+    the deck empty, so a game picks up again once cards are discarded. If
+    a full round goes by with no card played or drawn, no one can ever
+    play again, and the game is stopped with no winner (-1 from
+    play_batch, counted in n_unfinished). With nearly all the cards in
+    hands, a few cards can also cycle through the discard pile forever,
+    so games still going after max_turns are stopped the same way.
+
+    Parameters
+    ----------
+    players : list
+        BasePlayer or CommonColor objects (or classes).
+    seed : int (42)
+        Random number seed.
+    """
+
+    def __init__(self, players, seed=42):
+        self.rng = np.random.default_rng(seed)
+        self.players = players
+        self.common_color = np.array([isinstance(player, CommonColor) or player is CommonColor
+                                      for player in players])
+        for player in players:
+            cls = player if isinstance(player, type) else type(player)
+            if cls not in (BasePlayer, CommonColor):
+                raise ValueError("No vectorized policy for %s" % cls.__name__)
+
+        self.number, self.color, self.action, self.wild = encode_deck()
+        self.n_cards = N_CARDS
+        # Row for each up state, column for each card
+        self.playable_by_state = np.ascontiguousarray(PLAYABLE.T)
+        # Order to check colors in when breaking CommonColor ties (r, b, g, y)
+        self.tie_order = np.array([COLORS.index(c) for c in "rbgy"])
+        self.wins = np.zeros(len(self.players), dtype=int)
+        self.n_unfinished = 0
+
+    def _reshuffle(self, games):
+        """Shuffle the discard pile into the deck for games with an empty deck"""
+        games = games[self.head[games] >= self.deck_size[games]]
+        if games.size == 0:
+            return
+        keys = self.rng.random((games.size, self.n_cards))
+        keys[self.owner[games] != DISCARD] = np.inf
+        self.deck_order[games] = np.argsort(keys, axis=1)
+        self.deck_size[games] = np.sum(self.owner[games] == DISCARD, axis=1)
+        self.head[games] = 0
+        self.owner[games] = np.where(self.owner[games] == DISCARD, DECK, self.owner[games])
+
+    def _draw(self, games, players, n_draw=1):
+        """Draw n_draw cards from the deck into the players' hands"""
+        for i in range(n_draw):
+            # Games that couldn't draw last time may have discarded since
+            self._reshuffle(games)
+            can_draw = self.head[games] < self.deck_size[games]
+            g = games[can_draw]
+            p = players[can_draw]
+            cards = self.deck_order[g, self.head[g]]
+            self.head[g] += 1
+            self.owner[g, cards] = p
+            self.hand_time[g, cards] = self.clock[g]
+            self.clock[g] += 1
+            self.hand_count[g, p] += 1
+
+    def _pick_colors(self, games, players, cards):
+        """Color choice for played wild cards"""
+        choice = np.full(games.size, COLORS.index("b"))
+        common = self.common_color[players]
+        if np.any(common):
+            g = games[common]
+            in_hand = self.owner[g] == players[common][:, np.newaxis]
+            color_hist = np.zeros((g.size, len(COLORS)), dtype=int)
+            for i in range(len(COLORS)):
+                color_hist[:, i] = np.sum(in_hand & (self.color == i), axis=1)
+            # argmax takes the first max, so check in the tie breaking order
+            choice[common] = self.tie_order[np.argmax(color_hist[:, self.tie_order], axis=1)]
+        return choice
+
+    def play_batch(self, n_games, n_start=7, draw_max=4, max_turns=10000):
+        """Play n_games games at once
+
+        Parameters
+        ----------
+        n_games : int
+            Number of games.
+        n_start : int (7)
+            Number of cards dealt to each player.
+        draw_max : int (4)
+            Number of cards to draw before passing.
+        max_turns : int (10000)
+            Stop games that haven't finished after this many turns.
+
+        Returns
+        -------
+        winners : np.array of int
+            Index of the winning player of each game, -1 if the game
+            was stopped because no one could play or draw for a full
+            round, or it ran past max_turns.
+        """
+        n_players = len(self.players)
+        n_cards = self.n_cards
+        all_games = np.arange(n_games)
+
+        # shuffle up fresh decks and deal
+        self.deck_order = self.rng.permuted(np.tile(np.arange(n_cards), (n_games, 1)), axis=1)
+        self.owner = np.full((n_games, n_cards), DECK)
+        self.hand_time = np.zeros((n_games, n_cards), dtype=int)
+        self.hand_count = np.full((n_games, n_players), n_start)
+        n_dealt = n_players * n_start
+        for i in range(n_dealt):
+            self.owner[all_games, self.deck_order[:, i]] = i // n_start
+            self.hand_time[all_games, self.deck_order[:, i]] = i
+        self.clock = np.full(n_games, n_dealt)
+
+        # flip the top card, wilds go to the discard pile
+        wild_order = self.wild[self.deck_order]
+        wild_order[:, :n_dealt] = True
+        first = np.argmin(wild_order, axis=1)
+        for i in range(n_dealt, np.max(first)):
+            skipped = all_games[first > i]
+            self.owner[skipped, self.deck_order[skipped, i]] = DISCARD
+        top_card = self.deck_order[all_games, first]
+        self.owner[all_games, top_card] = TOP
+        top_color = self.color[top_card]
+        self.head = first + 1
+        self.deck_size = np.full(n_games, n_cards)
+
+        turn = np.zeros(n_games, dtype=int)
+        direction = np.ones(n_games, dtype=int)
+        winners = np.full(n_games, -1)
+        # Turns in a row with no card played or drawn
+        idle = np.zeros(n_games, dtype=int)
+        active = all_games
+
+        for n_turns in range(max_turns):
+            if active.size == 0:
+                break
+            clock = self.clock[active]
+            players = turn[active]
+            played = np.full(active.size, -1)
+            for attempt in range(draw_max):
+                trying = np.where(played < 0)[0]
+                if trying.size == 0:
+                    break
+                g = active[trying]
+                state = np.where(self.wild[top_card[g]], N_CARDS + top_color[g], top_card[g])
+                playable = (self.owner[g] == players[trying][:, np.newaxis]) & self.playable_by_state[state]
+                has_play = np.any(playable, axis=1)
+                first_card = np.argmin(np.where(playable, self.hand_time[g], np.iinfo(int).max), axis=1)
+
+                plays = trying[has_play]
+                played[plays] = first_card[has_play]
+                self.owner[active[plays], played[plays]] = TOP
+                self.hand_count[active[plays], players[plays]] -= 1
+
+                draws = trying[~has_play]
+                self._draw(active[draws], players[draws])
+
+            done = played >= 0
+            g = active[done]
+            cards = played[done]
+            p = players[done]
+            action = self.action[cards]
+            hit = (turn[g] + direction[g]) % n_players
+
+            turn[g] += (action == SKIP)
+            reverse = action == REVERSE
+            direction[g[reverse]] *= -1
+            if n_players == 2:
+                turn[g[reverse]] += 1
+            self._draw(g[action == PLUS2], hit[action == PLUS2], n_draw=2)
+            self._draw(g[action == WILD4], hit[action == WILD4], n_draw=4)
+
+            turn[active] = (turn[active] + direction[active]) % n_players
+
+            # The old top card goes on the discard pile, wild colors reset
+            self.owner[g, top_card[g]] = DISCARD
+            top_card[g] = cards
+            new_color = self.color[cards]
+            wild = self.wild[cards]
+            new_color[wild] = self._pick_colors(g[wild], p[wild], cards[wild])
+            top_color[g] = new_color
+
+            # Someone has no cards in their hand, they win.
+            finished = self.hand_count[g, p] == 0
+            winners[g[finished]] = p[finished]
+
+            # The clock ticks for every card drawn
+            idle[active] = np.where(done | (self.clock[active] > clock), 0, idle[active] + 1)
+            stuck = active[idle[active] >= n_players]
+            active = np.setdiff1d(active, np.concatenate([g[finished], stuck]), assume_unique=True)
+
+        return winners
+
+    def __call__(self, n_games=100, n_start=7, draw_max=4, batch_size=10000, max_turns=10000):
+        for start in range(0, n_games, batch_size):
+            winners = self.play_batch(min(batch_size, n_games - start), n_start=n_start,
+                                      draw_max=draw_max, max_turns=max_turns)
+            self.wins += np.bincount(winners[winners >= 0], minlength=len(self.players))
+            self.n_unfinished += np.count_nonzero(winners < 0)
+
+        return self.wins